@@ -0,0 +1,69 @@
+import gzip
+import os
+import zipfile
+from contextlib import contextmanager
+
+try:
+    import zstandard
+except ImportError:  # .zst dumps are optional
+    zstandard = None
+
+# Forms a collection dump can be stored in, tried in this order:
+#   <folder>/<collection>.json       plain
+#   <folder>/<collection>.json.gz    gzip
+#   <folder>/<collection>.json.zst   zstd (needs zstandard)
+# or as a <collection>.json entry (in any folder) of a .zip archive such as
+# collections.zip. Every form is decompressed as a stream, nothing is
+# unpacked to disk.
+DUMP_SUFFIXES = ['.json', '.json.gz', '.json.zst']
+
+
+def require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("zstd compressed dumps need zstandard: pip install zstandard")
+
+
+def is_zip_archive(path):
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+
+# Name of the <collection>.json entry of a zip archive; macOS resource forks are skipped
+def zip_entry(archive, collection_name):
+    for name in archive.namelist():
+        if os.path.basename(name) == f'{collection_name}.json' and not name.startswith('__MACOSX/'):
+            return name
+    raise FileNotFoundError(f"No {collection_name}.json in {archive.filename}")
+
+
+# Path of the dump of a collection in a folder, in the first form that exists
+def dump_path(folder, collection_name):
+    for suffix in DUMP_SUFFIXES:
+        path = os.path.join(folder, collection_name + suffix)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {collection_name}.json(.gz/.zst) dump in {folder}")
+
+
+# Open the dump of a collection as a binary file object that decompresses
+# while it is read. `collections_path` is a folder of dumps or a zip
+# archive; every call opens its own handle, so the collections can be read
+# from separate threads at the same time.
+@contextmanager
+def open_dump(collections_path, collection_name):
+    if is_zip_archive(collections_path):
+        with zipfile.ZipFile(collections_path) as archive:
+            with archive.open(zip_entry(archive, collection_name)) as file:
+                yield file
+        return
+
+    path = dump_path(collections_path, collection_name)
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as file:
+            yield file
+    elif path.endswith('.zst'):
+        require_zstandard()
+        with open(path, 'rb') as raw, zstandard.ZstdDecompressor().stream_reader(raw) as file:
+            yield file
+    else:
+        with open(path, 'rb') as file:
+            yield file
@@ -0,0 +1,53 @@
+import sys
+import json
+import time
+import zipfile
+import pandas as pd
+from flatten import COLLECTION_SCHEMAS, flatten_documents
+
+# Compares the schema-driven flattener against the pd.json_normalize path on
+# the Extended-JSON dumps shipped in collections.zip.
+#   python benchmark_flatten.py [path/to/collections.zip] [repeats]
+
+
+def load_collections(archive_path):
+    with zipfile.ZipFile(archive_path) as archive:
+        return {name: json.loads(archive.read(f'{name}.json')) for name in COLLECTION_SCHEMAS}
+
+
+def json_normalize_path(collection_name, documents):
+    if collection_name == 'sonar_results':
+        return pd.json_normalize(documents, sep='.', meta=['price_norm'], record_path=None, errors='ignore')
+    return pd.json_normalize(documents)
+
+
+def best_time(function, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    archive_path = sys.argv[1] if len(sys.argv) > 1 else 'collections.zip'
+    repeats = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    collections = load_collections(archive_path)
+
+    print(f"{'collection':<15}{'rows':>10}{'json_normalize':>16}{'flatten':>12}{'speedup':>10}")
+    for collection_name, documents in collections.items():
+        normalize_seconds, normalized_df = best_time(lambda: json_normalize_path(collection_name, documents), repeats)
+        flatten_seconds, flattened_df = best_time(
+            lambda: flatten_documents(collection_name, documents, extended_names=True), repeats
+        )
+
+        # Both paths must agree on the ids they produce
+        assert normalized_df['_id.$oid'].tolist() == flattened_df['_id.$oid'].tolist()
+
+        speedup = normalize_seconds / flatten_seconds if flatten_seconds > 0 else float('inf')
+        print(f"{collection_name:<15}{len(documents):>10}{normalize_seconds:>15.3f}s{flatten_seconds:>11.3f}s{speedup:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor
+from synthetic_data import write_json_dump
+
+# Times every pipeline stage (extract, transform, clean, create_tables, load)
+# on synthetic data at one or more scales and appends one JSON line per scale
+# to the results file, so runs can be compared with each other. After the
+# load, the queries of schema_layout.BENCHMARK_QUERIES are timed without and
+# with the secondary indexes.
+#   python benchmark_pipeline.py --scales 1e4 1e5 1e6 --form extended
+#   python benchmark_pipeline.py --scales 1e4 --no-load
+#   python benchmark_pipeline.py --scales 1e6 --partitions 16 --id-storage bytea
+#   python benchmark_pipeline.py --scales 1e8 --mode pipelined
+# --mode batch holds the whole extract in memory (about 2 KB per sonar
+# result, so 1e6 results need about 2 GB); --mode pipelined runs
+# etl_engine.run_pipelined batch by batch in bounded memory and is the way
+# to reach 1e7 and beyond. It always loads into PostgreSQL.
+
+BENCHMARK_PATH = 'benchmark_data'
+BENCHMARK_RESULTS = 'benchmark_results.jsonl'
+BENCHMARK_STAGES = ['extract', 'transform', 'clean', 'create_tables', 'load', 'pipelined', 'create_indexes']
+BENCHMARK_MODES = ['batch', 'pipelined']
+
+# Largest scale benchmarked in batch mode (about 20 GB of extract); beyond it use --mode pipelined
+BATCH_MAX_RESULTS = 10 ** 7
+
+
+# Generated dumps are kept per scale, form and seed and reused by later runs
+def prepare_dataset(results, form, seed, data_path=BENCHMARK_PATH, config_path=os.path.join('collections', 'config.json')):
+    run_path = os.path.join(data_path, f'{form}_{results}_seed{seed}')
+    collections_path = os.path.join(run_path, 'collections')
+    if not os.path.exists(os.path.join(collections_path, 'sonar_results.json')):
+        write_json_dump(collections_path, results, form, seed)
+    # The pipeline reads its PostgreSQL settings from collections/config.json
+    if os.path.exists(config_path):
+        shutil.copy(config_path, collections_path)
+    return run_path
+
+
+# One scale, run in a fresh process so its peak RSS is its own. Extended
+# dumps are read by the extended-json source of etl_engine, native dumps by
+# its native-json source. Batch mode times every stage on its own; pipelined
+# mode times the whole run_pipelined as stage `pipelined`, with the
+# per-stage stats of its pipeline in the report.
+def run_scale(run_path, form, load=True, partitions=0, id_storage='varchar', mode='batch'):
+    os.chdir(run_path)
+    import instrumentation
+    import etl_engine as pipeline
+    from id_codes import IdEncoder
+    from db_pool import close_pool
+    from schema_layout import create_indexes, drop_indexes, set_sonar_results_partitions, time_queries
+    from id_storage import set_id_storage
+    from sources import JsonDumpSource, NativeJsonSource
+    source = JsonDumpSource() if form == 'extended' else NativeJsonSource()
+
+    set_sonar_results_partitions(partitions)
+    set_id_storage(id_storage)
+    queries = None
+    try:
+        if mode == 'pipelined':
+            with instrumentation.step('benchmark.pipelined') as record:
+                stage_stats = pipeline.run_pipelined(source)
+                record['rows_out'] = stage_stats[0]['rows_out'] if stage_stats else 0
+        else:
+            with instrumentation.step('benchmark.extract') as record:
+                with source:
+                    data = pipeline.extract_data(source)
+                extracted_results = sum(len(batch) for batch in data[3])
+                record['rows_out'] = extracted_results
+            with instrumentation.step('benchmark.transform', rows_in=extracted_results) as record:
+                frames = pipeline.transform_data(source, *data)
+                record['rows_out'] = len(frames[3])
+            del data
+            id_encoder = IdEncoder()
+            with instrumentation.step('benchmark.clean', rows_in=len(frames[3])) as record:
+                cleaned = pipeline.clean_data(*frames, id_encoder)
+                record['rows_out'] = len(cleaned[4])
+            del frames
+            if load:
+                with instrumentation.step('benchmark.create_tables'):
+                    pipeline.create_tables()
+                with instrumentation.step('benchmark.load', rows_in=len(cleaned[4])) as record:
+                    pipeline.load_to_postgresql(*cleaned, id_encoder=id_encoder)
+                    record['rows_out'] = len(cleaned[4])
+        if load:
+            # The load builds the indexes; drop them to time the queries without
+            drop_indexes()
+            queries = {'before': time_queries()}
+            with instrumentation.step('benchmark.create_indexes'):
+                create_indexes()
+            queries['after'] = time_queries()
+    finally:
+        close_pool()
+    report = instrumentation.run_report()
+    report['queries'] = queries
+    return report
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def summarise(results, form, partitions, id_storage, report, mode='batch'):
+    stages = {}
+    for step in report['steps']:
+        if step['step'].startswith('benchmark.'):
+            name = step['step'].split('.', 1)[1]
+            rows = step['rows_in'] if step['rows_in'] is not None else step['rows_out']
+            stages[name] = {
+                'wall_seconds': step['wall_seconds'],
+                'cpu_seconds': step['cpu_seconds'],
+                'rows_per_sec': rows / step['wall_seconds'] if rows and step['wall_seconds'] > 0 else None,
+                'process_peak_rss_bytes': step['process_peak_rss_bytes'],
+            }
+    return {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'results': results,
+        'form': form,
+        'mode': mode,
+        'partitions': partitions,
+        'id_storage': id_storage,
+        'total_seconds': sum(stage['wall_seconds'] for stage in stages.values()),
+        'peak_rss_bytes': report['peak_rss_bytes'],
+        'stages': stages,
+        'queries': report.get('queries'),
+        'steps': report['steps'],
+        'pipelines': report['pipelines'],
+    }
+
+
+def print_summary(summary):
+    print(f"\n{summary['form']} form, {summary['mode']} mode, {summary['results']} sonar results "
+          f"({summary['total_seconds']:.2f}s, peak RSS {(summary['peak_rss_bytes'] or 0) / 2 ** 20:.0f} MiB)")
+    print(f"{'stage':<15}{'wall':>10}{'cpu':>10}{'rows/sec':>12}{'peak so far':>12}")
+    for name in BENCHMARK_STAGES:
+        if name in summary['stages']:
+            stage = summary['stages'][name]
+            rows_per_sec = f"{stage['rows_per_sec']:.0f}" if stage['rows_per_sec'] else '-'
+            print(f"{name:<15}{stage['wall_seconds']:>9.2f}s{stage['cpu_seconds']:>9.2f}s{rows_per_sec:>12}"
+                  f"{(stage['process_peak_rss_bytes'] or 0) / 2 ** 20:>8.0f} MiB")
+    if summary['queries']:
+        print(f"{'query':<26}{'no indexes':>12}{'indexes':>12}{'speedup':>9}")
+        for name, before in summary['queries']['before'].items():
+            after = summary['queries']['after'][name]
+            print(f"{name:<26}{before * 1000:>10.1f}ms{after * 1000:>10.1f}ms{before / after if after > 0 else 0:>8.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data")
+    parser.add_argument('--scales', type=float, nargs='+', default=[1e4, 1e5, 1e6],
+                        help="numbers of sonar_results, from 1e4 up to 1e8 (above 1e7 with --mode pipelined)")
+    parser.add_argument('--mode', choices=BENCHMARK_MODES, default='batch',
+                        help="batch: each stage over the whole data set in memory; pipelined: run_pipelined "
+                             "batch by batch, needs PostgreSQL (default: %(default)s)")
+    parser.add_argument('--form', choices=['extended', 'native'], default='extended')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-path', default=BENCHMARK_PATH, help="where the generated dumps are kept")
+    parser.add_argument('--output', default=BENCHMARK_RESULTS, help="JSON lines file the results are appended to")
+    parser.add_argument('--no-load', action='store_true', help="skip create_tables and the PostgreSQL load")
+    parser.add_argument('--partitions', type=int, default=0,
+                        help="hash partitions of a new sonar_results by part_id (0 for a plain table)")
+    parser.add_argument('--id-storage', choices=['varchar', 'bytea'], default='varchar',
+                        help="storage of the ObjectId keys in new tables")
+    args = parser.parse_args()
+    if args.mode == 'batch' and max(args.scales) > BATCH_MAX_RESULTS:
+        parser.error(f"batch mode holds the whole extract in memory; use --mode pipelined above {BATCH_MAX_RESULTS:.0e} results")
+    if args.mode == 'pipelined' and args.no_load:
+        parser.error("--mode pipelined loads batch by batch and cannot skip PostgreSQL")
+
+    for scale in args.scales:
+        results = int(scale)
+        run_path = os.path.abspath(prepare_dataset(results, args.form, args.seed, args.data_path))
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            report = executor.submit(run_scale, run_path, args.form, not args.no_load, args.partitions, args.id_storage,
+                                     args.mode).result()
+        print(f"Scale {results} finished in {time.perf_counter() - start:.2f}s")
+
+        summary = summarise(results, args.form, args.partitions, args.id_storage, report, args.mode)
+        print_summary(summary)
+        with open(args.output, 'a') as f:
+            f.write(json.dumps(summary, default=str) + '\n')
+    print(f"Results appended to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
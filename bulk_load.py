@@ -0,0 +1,187 @@
+import io
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+from id_storage import from_storage_id, to_storage_ids
+
+# Number of DataFrame rows serialised into one COPY buffer
+COPY_CHUNK_ROWS = 100000
+
+# Target columns and conflict key of every bulk-loaded table. The key is the
+# default for a table that does not exist yet; loads use the primary key of
+# the table as it exists (see conflict_columns).
+BULK_TABLES = {
+    'clients_table': (['client_id', 'client_name', 'contract_start'], ['client_id']),
+    'suppliers_table': (['supplier_id', 'supplier_name', 'country'], ['supplier_id']),
+    'sonar_runs': (['sonar_run_id', 'status', 'date', 'client_id'], ['sonar_run_id']),
+    'sonar_run_suppliers': (['sonar_run_id', 'supplier_id'], ['sonar_run_id', 'supplier_id']),
+    'sonar_results': (['sonar_result_id', 'sonar_run_id', 'supplier_id', 'price_norm', 'part_id'], ['sonar_result_id']),
+    # Keyed by run date first, so the load (sorted by key) writes it in time order
+    'price_history': (['run_date', 'sonar_result_id', 'part_id', 'supplier_id', 'price_norm'], ['run_date', 'sonar_result_id']),
+}
+
+# Load order: a table only references tables of earlier stages, so the
+# tables within one stage can be loaded concurrently
+LOAD_STAGES = [
+    ['clients_table', 'suppliers_table'],
+    ['sonar_runs'],
+    ['sonar_run_suppliers', 'sonar_results', 'price_history'],
+]
+
+# Large tables that are split into key ranges across the load workers
+PARTITIONED_TABLES = {'sonar_run_suppliers', 'sonar_results', 'price_history'}
+
+# Primary key columns of each loaded table, read from the database once
+_conflict_columns = {}
+_conflict_columns_lock = threading.Lock()
+
+
+# Conflict key of `table` for ON CONFLICT: its actual primary key, so e.g. a
+# sonar_results created hash-partitioned (keyed (sonar_result_id, part_id))
+# loads whatever schema_layout is set to now. Falls back to the key in
+# BULK_TABLES while the table does not exist; that is not cached.
+def conflict_columns(cursor, table):
+    with _conflict_columns_lock:
+        if table not in _conflict_columns:
+            cursor.execute(
+                "SELECT a.attname FROM pg_index i "
+                "JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey) "
+                "WHERE i.indrelid = to_regclass(%s) AND i.indisprimary "
+                "ORDER BY array_position(i.indkey::int2[], a.attnum)", [f'public.{table}']
+            )
+            columns = [row[0] for row in cursor.fetchall()]
+            if not columns:
+                return BULK_TABLES[table][1]
+            _conflict_columns[table] = columns
+        return _conflict_columns[table]
+
+
+# Stream a DataFrame into a temporary staging table with COPY FROM STDIN
+def copy_to_staging(cursor, df, staging_table, columns, chunk_rows=COPY_CHUNK_ROWS):
+    copy_statement = sql.SQL("COPY {} ({}) FROM STDIN WITH (FORMAT csv)").format(
+        sql.Identifier(staging_table),
+        sql.SQL(', ').join(map(sql.Identifier, columns))
+    ).as_string(cursor)
+
+    # Serialise chunk by chunk so only one CSV buffer is held in memory at a time
+    for start in range(0, len(df), chunk_rows):
+        buffer = io.StringIO()
+        df.iloc[start:start + chunk_rows].to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+        cursor.copy_expert(copy_statement, buffer)
+
+
+# Temp table `name` with `columns` typed like those of `table` (whichever id
+# storage it was created with) but without its constraints, filled with
+# df[columns] through COPY, hex ids converted for bytea columns. Yields the
+# name and drops the table again after the block.
+@contextmanager
+def staging_table(cursor, name, table, columns, df):
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(name)))
+    cursor.execute(sql.SQL("CREATE TEMP TABLE {} AS SELECT {} FROM public.{} WITH NO DATA").format(
+        sql.Identifier(name), sql.SQL(', ').join(map(sql.Identifier, columns)), sql.Identifier(table)
+    ))
+    copy_to_staging(cursor, to_storage_ids(cursor, df[columns], table), name, columns)
+    yield name
+    cursor.execute(sql.SQL("DROP TABLE IF EXISTS {}").format(sql.Identifier(name)))
+
+
+# Bulk load a DataFrame: COPY into a staging table, then one set-based
+# INSERT ... SELECT ... ON CONFLICT DO NOTHING into the target table.
+# `df` must already carry the target column names (ids in hex form).
+# `update_columns` turns the insert into an upsert (ON CONFLICT DO UPDATE).
+def bulk_insert(cursor, df, table, columns, conflict_columns, update_columns=None):
+    start = time.perf_counter()
+
+    # DO UPDATE may touch each target row only once per statement
+    if update_columns:
+        df = df.drop_duplicates(subset=conflict_columns, keep='last')
+
+    if update_columns:
+        conflict_action = sql.SQL("DO UPDATE SET ") + sql.SQL(', ').join(
+            sql.SQL("{0} = EXCLUDED.{0}").format(sql.Identifier(c)) for c in update_columns
+        )
+    else:
+        conflict_action = sql.SQL("DO NOTHING")
+
+    with staging_table(cursor, f"{table}_staging", table, columns, df) as staging:
+        cursor.execute(sql.SQL(
+            "INSERT INTO public.{table} ({columns}) "
+            "SELECT {staged} FROM {staging} s "
+            "ON CONFLICT ({conflict}) {action}"
+        ).format(
+            table=sql.Identifier(table),
+            columns=sql.SQL(', ').join(map(sql.Identifier, columns)),
+            staged=sql.SQL(', ').join(sql.SQL("s.{}").format(sql.Identifier(c)) for c in columns),
+            staging=sql.Identifier(staging),
+            conflict=sql.SQL(', ').join(map(sql.Identifier, conflict_columns)),
+            action=conflict_action
+        ))
+        inserted = cursor.rowcount
+
+    elapsed = time.perf_counter() - start
+    rows_per_sec = len(df) / elapsed if elapsed > 0 else float('inf')
+    print(f"{table}: {len(df)} rows staged, {inserted} inserted in {elapsed:.2f}s ({rows_per_sec:.0f} rows/sec)")
+    return {"table": table, "rows": len(df), "inserted": inserted, "seconds": elapsed, "rows_per_sec": rows_per_sec}
+
+
+# Run bulk_insert inside a savepoint so a failing table does not abort the
+# whole load transaction
+def bulk_insert_table(cursor, df, table, columns, conflict_columns, update_columns=None):
+    cursor.execute("SAVEPOINT bulk_table")
+    try:
+        stats = bulk_insert(cursor, df, table, columns, conflict_columns, update_columns)
+        cursor.execute("RELEASE SAVEPOINT bulk_table")
+        return stats
+    except Exception as e:
+        cursor.execute("ROLLBACK TO SAVEPOINT bulk_table")
+        print(f"Error bulk loading {table}: {e}")
+        return None
+
+
+# Delete the rows matching the key columns of `keys` (a DataFrame of hex ids
+# and other key values) through a staging table. Returns the `returning`
+# columns of the deleted rows as a DataFrame, ids in hex form.
+def delete_keys(cursor, table, keys, returning=None):
+    columns = list(keys.columns)
+    returning = returning or columns
+    with staging_table(cursor, f"{table}_deleted", table, columns, keys) as staging:
+        cursor.execute(sql.SQL("DELETE FROM public.{table} t USING {staging} s WHERE {match} RETURNING {returning}").format(
+            table=sql.Identifier(table),
+            staging=sql.Identifier(staging),
+            match=sql.SQL(' AND ').join(sql.SQL("t.{0} = s.{0}").format(sql.Identifier(c)) for c in columns),
+            returning=sql.SQL(', ').join(sql.SQL("t.{}").format(sql.Identifier(c)) for c in returning)
+        ))
+        return pd.DataFrame([[from_storage_id(value) for value in row] for row in cursor.fetchall()], columns=returning)
+
+
+# Set `column` to NULL in the rows of `table` that reference one of `keys`
+# (a DataFrame of that one column, hex ids) through a staging table.
+# Returns the number of rows updated.
+def clear_references(cursor, table, column, keys):
+    with staging_table(cursor, f"{table}_cleared", table, [column], keys) as staging:
+        cursor.execute(sql.SQL("UPDATE public.{table} t SET {column} = NULL FROM {staging} s WHERE t.{column} = s.{column}").format(
+            table=sql.Identifier(table), column=sql.Identifier(column), staging=sql.Identifier(staging)
+        ))
+        return cursor.rowcount
+
+
+# Split a df sorted by key_columns (the whole conflict key) into contiguous
+# chunks of about chunk_rows rows. Chunk bounds are moved back to the first
+# row of their key, so equal keys always land in the same chunk and
+# concurrent ON CONFLICT inserts of different chunks never race on the same
+# key. Only the full key is kept together, so a composite key with few
+# distinct leading values (price_history's run_date) still splits evenly.
+def key_range_chunks(df, key_columns, chunk_rows):
+    if len(df) <= chunk_rows:
+        return [df]
+    keys = df[key_columns]
+    key_starts = np.flatnonzero(keys.ne(keys.shift()).any(axis=1).to_numpy())
+    bounds = {0, len(df)}
+    for bound in range(chunk_rows, len(df), chunk_rows):
+        bounds.add(int(key_starts[np.searchsorted(key_starts, bound, side='right') - 1]))
+    bounds = sorted(bounds)
+    return [df.iloc[start:end] for start, end in zip(bounds, bounds[1:]) if end > start]
@@ -0,0 +1,74 @@
+import os
+import time
+
+# Collections tailed by the change-data-capture mode
+CDC_COLLECTIONS = ['clients', 'suppliers', 'sonar_runs', 'sonar_results']
+
+# A micro-batch is closed after this many change events, or this many
+# seconds after its first event, whichever comes first
+CDC_BATCH_SIZE = 5000
+CDC_BATCH_SECONDS = 5.0
+
+# Resume token of the last applied micro-batch
+RESUME_TOKEN_FILE = os.path.join('collections', 'resume_token.json')
+
+
+# The changes of one micro-batch per collection: the latest full document of
+# every inserted, updated or replaced _id, and the deleted _ids. A later
+# event on the same _id replaces the earlier one, so each key is applied once
+# and in the order MongoDB reported it.
+class ChangeBatch:
+    def __init__(self, collections=CDC_COLLECTIONS):
+        self.upserts = {name: {} for name in collections}
+        self.deletes = {name: set() for name in collections}
+        self.events = 0
+        self.resume_token = None
+
+    def __len__(self):
+        return self.events
+
+    def add(self, change):
+        name = change['ns']['coll']
+        key = change['documentKey']['_id']
+        self.events += 1
+        self.resume_token = change['_id']
+        if change['operationType'] == 'delete':
+            self.upserts[name].pop(key, None)
+            self.deletes[name].add(key)
+        elif change.get('fullDocument') is not None:
+            # An update of a document deleted since has no fullDocument; its delete event follows
+            self.deletes[name].discard(key)
+            self.upserts[name][key] = change['fullDocument']
+
+    def documents(self, name):
+        return list(self.upserts[name].values())
+
+    def deleted_ids(self, name):
+        return [str(key) for key in self.deletes[name]]
+
+
+# Tail one database change stream filtered to the collections and yield
+# ChangeBatch micro-batches. Updates carry the full current document
+# (updateLookup). With a resume token the stream continues right after the
+# last applied batch, so nothing is lost across restarts. Change streams need
+# a replica set; a single-node one is enough.
+def change_batches(db, resume_token=None, batch_size=CDC_BATCH_SIZE, batch_seconds=CDC_BATCH_SECONDS,
+                   collections=CDC_COLLECTIONS):
+    pipeline = [{'$match': {
+        'ns.coll': {'$in': collections},
+        'operationType': {'$in': ['insert', 'update', 'replace', 'delete']},
+    }}]
+    max_await_ms = int(min(batch_seconds, 1.0) * 1000)
+    with db.watch(pipeline, full_document='updateLookup', resume_after=resume_token,
+                  max_await_time_ms=max_await_ms) as stream:
+        batch = ChangeBatch(collections)
+        opened = None
+        while stream.alive:
+            change = stream.try_next()
+            if change is not None:
+                batch.add(change)
+                opened = opened or time.monotonic()
+            if batch.events and (batch.events >= batch_size or time.monotonic() - opened >= batch_seconds):
+                yield batch
+                batch = ChangeBatch(collections)
+                opened = None
@@ -0,0 +1,52 @@
+import os
+import json
+import threading
+import pandas as pd
+from watermarks import save_json_atomic
+
+# Committed chunks of every table whose load has not finished yet
+CHECKPOINTS_FILE = os.path.join('collections', 'load_checkpoints.json')
+
+
+# Identifies the frame a checkpoint belongs to: a checkpoint written for
+# other input data or another chunk size is never resumed from
+def frame_fingerprint(df, key_columns, chunk_rows):
+    key_hash = int(pd.util.hash_pandas_object(df[key_columns], index=False).sum()) if len(df) else 0
+    return f"{len(df)}:{chunk_rows}:{key_hash:x}"
+
+
+# Per-table record of the chunks committed so far: {table: {"fingerprint", "chunks"}}.
+# The file is rewritten after every committed chunk and a table's entry is
+# dropped once all of its chunks are in, so only interrupted loads leave one.
+class LoadCheckpoints:
+    def __init__(self, file_path=CHECKPOINTS_FILE):
+        self.file_path = file_path
+        self.lock = threading.Lock()
+        self.tables = {}
+        if os.path.exists(file_path):
+            with open(file_path, 'r') as f:
+                self.tables = json.load(f)
+
+    # Chunk numbers already committed for this exact frame of the table
+    def committed_chunks(self, table, fingerprint):
+        with self.lock:
+            entry = self.tables.get(table)
+            if entry is None or entry['fingerprint'] != fingerprint:
+                return set()
+            return set(entry['chunks'])
+
+    def mark_committed(self, table, fingerprint, chunk):
+        with self.lock:
+            entry = self.tables.get(table)
+            if entry is None or entry['fingerprint'] != fingerprint:
+                entry = self.tables[table] = {'fingerprint': fingerprint, 'chunks': []}
+            entry['chunks'].append(chunk)
+            self.save()
+
+    def finish(self, table):
+        with self.lock:
+            if self.tables.pop(table, None) is not None:
+                self.save()
+
+    def save(self):
+        save_json_atomic(self.tables, self.file_path)
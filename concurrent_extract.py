@@ -0,0 +1,112 @@
+import queue
+import threading
+from datetime import datetime, timezone
+from bson import ObjectId
+
+# Batches buffered per collection before its scans block (backpressure)
+EXTRACT_QUEUE_SIZE = 8
+
+# Parallel _id range scans over sonar_results
+RANGE_SCAN_SEGMENTS = 4
+
+# Put on a collection queue by every scan once it is done
+_DONE = object()
+
+
+# Split the _id space of a collection into `segments` range queries of equal
+# ObjectId generation-time spans. Ranges are half-open, so together they cover
+# every document of `query` exactly once.
+def id_range_queries(collection, segments, query=None):
+    query = query or {}
+    first = collection.find_one(query, {'_id': 1}, sort=[('_id', 1)])
+    last = collection.find_one(query, {'_id': 1}, sort=[('_id', -1)])
+    if segments <= 1 or first is None or not isinstance(first['_id'], ObjectId):
+        return [query]
+
+    start = first['_id'].generation_time.timestamp()
+    end = last['_id'].generation_time.timestamp()
+    bounds = [
+        ObjectId.from_datetime(datetime.fromtimestamp(start + (end - start) * segment / segments, tz=timezone.utc))
+        for segment in range(1, segments)
+    ]
+
+    queries = []
+    for lower, upper in zip([None] + bounds, bounds + [None]):
+        id_filter = {}
+        if lower is not None:
+            id_filter['$gte'] = lower
+        if upper is not None:
+            id_filter['$lt'] = upper
+        queries.append({'$and': [query, {'_id': id_filter}]} if query else {'_id': id_filter})
+    return queries
+
+
+# Runs the scans of several collections concurrently, one thread per scan
+# (a pymongo cursor or a dump reader). Each scan pushes its batches into the bounded queue of its
+# collection, and consume() hands them to the transform as they arrive, so
+# extraction keeps going while earlier batches are transformed and loaded.
+# `batches` is a callable (collection_name, query) -> iterable of batches.
+class ConcurrentExtractor:
+    def __init__(self, batches, queue_size=EXTRACT_QUEUE_SIZE):
+        self.batches = batches
+        self.queue_size = queue_size
+        self.queues = {}
+        self.scans = {}
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    # Start one scan per query of the collection
+    def start(self, collection_name, queries):
+        batch_queue = queue.Queue(maxsize=self.queue_size)
+        self.queues[collection_name] = batch_queue
+        self.scans[collection_name] = len(queries)
+        for query in queries:
+            thread = threading.Thread(target=self._scan, args=(collection_name, query, batch_queue), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def _scan(self, collection_name, query, batch_queue):
+        try:
+            for batch in self.batches(collection_name, query):
+                if not self._put(batch_queue, batch):
+                    return
+        except Exception as e:
+            # Re-raised in the consuming thread
+            self._put(batch_queue, e)
+        finally:
+            self._put(batch_queue, _DONE)
+
+    # Blocking put that gives up once the extractor is shut down
+    def _put(self, batch_queue, item):
+        while not self.stopped.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    # Yield the batches of a collection, in arrival order, until all its scans are done
+    def consume(self, collection_name):
+        batch_queue = self.queues[collection_name]
+        running = self.scans[collection_name]
+        while running:
+            item = batch_queue.get()
+            if item is _DONE:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+
+    def shutdown(self):
+        self.stopped.set()
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
@@ -0,0 +1,45 @@
+import os
+import numpy as np
+import pandas as pd
+
+# Folder the rejected-rows reports are written to
+REJECTED_ROWS_PATH = 'collections'
+
+
+# Vectorized referential check: split df into rows whose key columns all exist
+# in the given valid-key sets and rejected rows tagged with the first failing
+# check. `checks` is a list of (column, valid_keys, reason) tuples.
+def filter_references(df, checks):
+    rejected_reason = pd.Series(None, index=df.index, dtype=object)
+    for column, valid_keys, reason in checks:
+        missing = ~df[column].isin(valid_keys) & rejected_reason.isna()
+        rejected_reason[missing] = reason
+
+    rejected_mask = rejected_reason.notna()
+    rejected_df = df[rejected_mask].assign(rejected_reason=rejected_reason[rejected_mask])
+    return df[~rejected_mask], rejected_df
+
+
+# Drop rows duplicating another on the `subset` columns, keeping the one with
+# the smallest `key` of each group whatever the input order. The rows kept
+# stay in input order.
+def drop_duplicates_keep_smallest(df, subset, key):
+    kept = df.reset_index(drop=True).sort_values(key, kind='stable').drop_duplicates(subset=subset, keep='first')
+    return df.iloc[np.sort(kept.index.to_numpy())]
+
+
+# Print per-reason counts and write the rejected rows to rejected_<table>.csv.
+# append=True adds to the report of an earlier batch instead of replacing it.
+def report_rejected_rows(table, rejected_df, output_path=REJECTED_ROWS_PATH, append=False):
+    counts = rejected_df['rejected_reason'].value_counts().to_dict()
+    print(f"{table}: {len(rejected_df)} rows rejected")
+    for reason, count in counts.items():
+        print(f"  {reason}: {count}")
+
+    report_file = os.path.join(output_path, f'rejected_{table}.csv')
+    if append:
+        rejected_df.to_csv(report_file, mode='a', header=not os.path.exists(report_file), index=False)
+    else:
+        rejected_df.to_csv(report_file, index=False)
+    print(f"Rejected rows written to {report_file}")
+    return counts
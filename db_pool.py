@@ -0,0 +1,165 @@
+import os
+import json
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.pool import ThreadedConnectionPool
+from bulk_load import BULK_TABLES, LOAD_STAGES, PARTITIONED_TABLES, bulk_insert_table, conflict_columns, key_range_chunks
+from instrumentation import step
+from checkpoints import LoadCheckpoints, frame_fingerprint
+
+CONFIG_PATH = os.path.join('collections', 'config.json')
+
+# Default number of concurrent load workers (and pooled connections)
+LOAD_WORKERS = 4
+
+# Rows, and in-memory bytes, loaded and committed per transaction
+COMMIT_CHUNK_ROWS = 500000
+COMMIT_CHUNK_BYTES = 256 * 1024 * 1024
+
+# Connection pool shared by create_tables and every load of the pipeline
+_pool = None
+_workers = LOAD_WORKERS
+_commit_rows = COMMIT_CHUNK_ROWS
+_commit_bytes = COMMIT_CHUNK_BYTES
+
+
+# Set the worker count the pool is sized for; call before the pool is created
+def set_load_workers(workers):
+    global _workers
+    _workers = workers
+
+
+# Create the shared pool once; later calls return the existing pool
+def init_pool(workers=None, config_path=CONFIG_PATH):
+    global _pool, _workers
+    if _pool is None:
+        workers = workers or _workers
+        with open(config_path, 'r') as f:
+            config = json.load(f)
+        _pool = ThreadedConnectionPool(
+            1, workers + 1,
+            host=config["DB_HOST"],
+            database=config["DB_NAME"],
+            user=config["DB_USER"],
+            password=config["DB_PASSWORD"]
+        )
+        _workers = workers
+    return _pool
+
+
+def load_workers():
+    return _workers
+
+
+# Set the commit chunk size; a chunk ends at whichever limit is reached first
+def set_commit_chunk(rows=COMMIT_CHUNK_ROWS, max_bytes=COMMIT_CHUNK_BYTES):
+    global _commit_rows, _commit_bytes
+    _commit_rows = rows
+    _commit_bytes = max_bytes
+
+
+# Rows per committed chunk of df. Partitioned tables are cut into at least
+# one chunk per worker so the workers share the table.
+def commit_chunk_rows(df, workers=1):
+    chunk_rows = _commit_rows
+    if _commit_bytes and len(df):
+        row_bytes = df.memory_usage(index=False, deep=True).sum() / len(df)
+        chunk_rows = min(chunk_rows, int(_commit_bytes // max(row_bytes, 1)))
+    if workers > 1:
+        chunk_rows = min(chunk_rows, -(-len(df) // workers))
+    return max(chunk_rows, 1)
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.closeall()
+        _pool = None
+
+
+# Borrow a connection from the pool; commits on success, rolls back on error
+@contextmanager
+def pooled_connection(autocommit=False):
+    pool = init_pool()
+    conn = pool.getconn()
+    conn.autocommit = autocommit
+    try:
+        yield conn
+        if not autocommit:
+            conn.commit()
+    except Exception:
+        if not autocommit:
+            conn.rollback()
+        raise
+    finally:
+        conn.autocommit = False
+        pool.putconn(conn)
+
+
+# Bulk load one frame (or key-range partition) on its own pooled connection
+def load_partition(df, table, update=False):
+    columns, _ = BULK_TABLES[table]
+    with step(f'load.{table}', rows_in=len(df)) as record:
+        with pooled_connection() as conn:
+            with conn.cursor() as cursor:
+                key = conflict_columns(cursor, table)
+                update_columns = [column for column in columns if column not in key] if update else None
+                stats = bulk_insert_table(cursor, df, table, columns, key, update_columns=update_columns)
+        # Rows left out by ON CONFLICT DO NOTHING count as dropped
+        record['rows_out'] = stats['inserted'] if stats is not None else 0
+    return stats
+
+
+# Load one chunk in its own transaction and record it in the checkpoint file
+# once committed. A crash between the commit and the checkpoint only means the
+# chunk is sent again on resume, which ON CONFLICT makes harmless.
+def load_chunk(df, table, update, checkpoints, fingerprint, chunk):
+    stats = load_partition(df, table, update)
+    if stats is not None:
+        checkpoints.mark_committed(table, fingerprint, chunk)
+    return stats
+
+
+# Load {table: frame} stage by stage (see LOAD_STAGES). Each table is sorted
+# by its key and cut into chunks (see set_commit_chunk) that are committed
+# one by one; chunks committed by an interrupted earlier run of the same
+# frame are skipped. Tables of a stage and the chunks of a table run
+# concurrently. upsert_tables are loaded with ON CONFLICT DO UPDATE.
+# Returns the stats of the loaded chunks and whether every chunk of every
+# table is committed (by this call or by the interrupted run it resumes).
+def load_tables_parallel(frames, workers=None, upsert_tables=(), checkpoints=None):
+    init_pool(workers)
+    # Never run more workers than the pool has connections for
+    workers = min(workers or load_workers(), load_workers())
+    if checkpoints is None:
+        checkpoints = LoadCheckpoints()
+    load_stats = []
+    complete = True
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        keys = {table: conflict_columns(cursor, table) for stage in LOAD_STAGES for table in stage if table in frames}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for stage in LOAD_STAGES:
+            futures = {}
+            for table in stage:
+                if table not in frames:
+                    continue
+                df = frames[table].sort_values(keys[table], kind='stable')
+                chunk_rows = commit_chunk_rows(df, workers if table in PARTITIONED_TABLES else 1)
+                chunks = key_range_chunks(df, keys[table], chunk_rows)
+                fingerprint = frame_fingerprint(df, keys[table], chunk_rows)
+                committed = checkpoints.committed_chunks(table, fingerprint)
+                if committed:
+                    print(f"{table}: resuming, {len(committed)} of {len(chunks)} chunks already committed")
+                futures[table] = [
+                    executor.submit(load_chunk, chunk_df, table, table in upsert_tables, checkpoints, fingerprint, number)
+                    for number, chunk_df in enumerate(chunks) if number not in committed
+                ]
+            # Wait for the whole stage before loading tables that reference it
+            for table, table_futures in futures.items():
+                table_stats = [future.result() for future in table_futures]
+                load_stats.extend(table_stats)
+                if all(stats is not None for stats in table_stats):
+                    checkpoints.finish(table)
+                else:
+                    complete = False
+    return [stats for stats in load_stats if stats is not None], complete
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+from bulk_load import BULK_TABLES, bulk_insert_table
+from db_pool import load_tables_parallel, pooled_connection
+from id_storage import binary_columns
+from instrumentation import step
+
+# Dimension tables whose rows are only sent when new or changed, with their key
+HASHED_TABLES = {'clients_table': 'client_id', 'suppliers_table': 'supplier_id'}
+
+# Content hash of every loaded dimension row. Kept in PostgreSQL next to the
+# rows, so a reset database also starts without hashes.
+DIMENSION_HASHES_TABLE = """
+CREATE TABLE IF NOT EXISTS public.dimension_hashes (
+    table_name VARCHAR,
+    key VARCHAR,
+    row_hash BIGINT NOT NULL,
+    CONSTRAINT dimension_hashes_pk PRIMARY KEY (table_name, key)
+);
+"""
+
+
+def create_dimension_hashes_table(cursor):
+    cursor.execute(DIMENSION_HASHES_TABLE)
+
+
+# One int64 hash per row over all target columns, computed vectorised on
+# their string form so the hash does not depend on the column dtypes
+def row_hashes(df, table):
+    columns, _ = BULK_TABLES[table]
+    hashes = pd.util.hash_pandas_object(df[columns].astype(str), index=False).to_numpy().view(np.int64)
+    return pd.Series(hashes, index=df[HASHED_TABLES[table]].to_numpy())
+
+
+# Stored hashes of the rows still in `table`, by key. Joined with the table,
+# so a row that was deleted (e.g. by change-capture) or a dropped table has
+# no hash and counts as new. Hashes are keyed by the hex form of bytea keys.
+def stored_hashes(table):
+    key_column = HASHED_TABLES[table]
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        key = sql.SQL("t.{}").format(sql.Identifier(key_column))
+        if key_column in binary_columns(cursor, table):
+            key = sql.SQL("encode({}, 'hex')").format(key)
+        cursor.execute(sql.SQL(
+            "SELECT h.key, h.row_hash FROM public.dimension_hashes h "
+            "JOIN public.{table} t ON h.key = {key} WHERE h.table_name = %s"
+        ).format(table=sql.Identifier(table), key=key), [table])
+        rows = cursor.fetchall()
+    return pd.Series([row_hash for _, row_hash in rows], index=[key for key, _ in rows], dtype=np.int64)
+
+
+# Keep only the rows of the hashed tables whose hash differs from the stored
+# one (or that have none). Returns the filtered frames and the new hashes of
+# the rows kept, to be stored once they are loaded.
+def changed_rows(frames):
+    frames = dict(frames)
+    pending = {}
+    for table in HASHED_TABLES:
+        if table not in frames or frames[table].empty:
+            continue
+        with step(f'hash.{table}', rows_in=len(frames[table])) as record:
+            hashes = row_hashes(frames[table], table)
+            try:
+                previous = stored_hashes(table)
+            except Exception as e:
+                print(f"Error reading the row hashes of {table}, sending every row: {e}")
+                previous = pd.Series([], dtype=np.int64)
+            stored = previous.astype('Int64').reindex(hashes.index)
+            changed = (hashes.astype('Int64') != stored).fillna(True).to_numpy(dtype=bool)
+            frames[table] = frames[table][changed]
+            pending[table] = hashes[changed]
+            record['rows_out'] = int(changed.sum())
+        print(f"{table}: {int(changed.sum())} of {len(changed)} rows new or changed")
+    return frames, pending
+
+
+# Store the hashes of the tables whose rows were all loaded
+def save_row_hashes(pending, load_stats):
+    loaded_rows = {}
+    for stats in load_stats:
+        loaded_rows[stats['table']] = loaded_rows.get(stats['table'], 0) + stats['rows']
+    for table, hashes in pending.items():
+        if hashes.empty or loaded_rows.get(table, 0) < len(hashes):
+            continue
+        df = pd.DataFrame({'table_name': table, 'key': hashes.index, 'row_hash': hashes.to_numpy()})
+        try:
+            with pooled_connection() as conn, conn.cursor() as cursor:
+                bulk_insert_table(cursor, df, 'dimension_hashes', ['table_name', 'key', 'row_hash'],
+                                  ['table_name', 'key'], update_columns=['row_hash'])
+        except Exception as e:
+            print(f"Error saving the row hashes of {table}: {e}")
+
+
+# load_tables_parallel with change detection: clients and suppliers are cut
+# down to new or changed rows and upserted (ON CONFLICT DO UPDATE), so
+# unchanged dimensions cost a hash and one key/hash query per run. Returns
+# the (stats, complete) pair of load_tables_parallel and the keys sent per
+# hashed table, e.g. for the rollups of suppliers that changed country.
+def load_changed_dimensions(frames, workers=None, upsert_tables=()):
+    frames, pending = changed_rows(frames)
+    load_stats, complete = load_tables_parallel(frames, workers, upsert_tables=set(upsert_tables) | set(HASHED_TABLES))
+    save_row_hashes(pending, load_stats)
+    return load_stats, complete, {table: hashes.index for table, hashes in pending.items()}
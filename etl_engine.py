@@ -0,0 +1,1008 @@
+import argparse
+import itertools
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+from bulk_load import BULK_TABLES, LOAD_STAGES, clear_references, conflict_columns, delete_keys
+from db_pool import (COMMIT_CHUNK_BYTES, COMMIT_CHUNK_ROWS, LOAD_WORKERS, close_pool, commit_chunk_rows, init_pool,
+                     load_tables_parallel, pooled_connection, set_commit_chunk, set_load_workers)
+from data_quality import drop_duplicates_keep_smallest, filter_references, report_rejected_rows
+from watermarks import load_watermarks, save_watermarks
+from change_streams import CDC_BATCH_SECONDS, CDC_BATCH_SIZE, RESUME_TOKEN_FILE, change_batches
+from field_mappings import COLLECTION_MAPPINGS, id_entities
+from flatten import flatten_collection
+from sources import (COLLECTIONS_PATH, EXTRACT_BATCH_SIZE, SOURCE_ERRORS, JsonDumpSource, MongoSource,
+                     NativeJsonSource, SnapshotSource)
+from id_codes import IdEncoder, pair_keys
+from concurrent_extract import RANGE_SCAN_SEGMENTS
+from pipeline_stages import Pipeline
+from rollups import create_rollup_tables, refresh_rollups
+from dimension_hashes import create_dimension_hashes_table, load_changed_dimensions
+from price_history import create_price_history_table, map_run_dates, price_history_frames, run_dates
+from key_cache import KEY_CACHE_CAPACITY, KeyCache, set_key_cache_capacity
+from id_storage import (ID_STORAGE, binary_columns, create_hex_views, from_storage_id, id_column_type, id_storage,
+                        set_id_storage)
+from schema_layout import (SONAR_RESULTS_PARTITIONS, create_indexes, create_partitioned_sonar_results,
+                           set_sonar_results_partitions, sonar_results_partitions)
+from instrumentation import RUN_REPORT_PATH, configure, debug_frame, debug_print, step, write_run_report
+from parallel_transform import TRANSFORM_WORKERS, transform_sonar_results_parallel
+
+# One pipeline engine for every source of the collections. The source is
+# picked with --source; everything after the extract works on DataFrames with
+# the target columns of field_mappings.COLLECTION_MAPPINGS.
+#   python etl_engine.py --source mongo
+#   python etl_engine.py --source extended-json --mode batch --workers 4
+#   python etl_engine.py --source extended-json --collections collections.zip
+#   python etl_engine.py --source snapshot --snapshot-origin native-json
+SOURCES = ['mongo', 'extended-json', 'native-json', 'snapshot']
+
+# pipelined: dimensions first, then sonar_results batch by batch through
+#            concurrent transform, clean and load stages
+# batch: every collection read completely, then transformed, cleaned and loaded
+# change-capture: tail the MongoDB change streams (mongo source only)
+MODES = ['pipelined', 'batch', 'change-capture']
+
+COLLECTION_NAMES = list(COLLECTION_MAPPINGS)
+DIMENSION_COLLECTIONS = ['clients', 'suppliers', 'sonar_runs']
+
+# Entity code space of the sonar_results id columns that are encoded: the
+# referenced run and supplier ids filtering and dedup work on. The result
+# and part ids are mostly distinct and are only passed through, so they stay
+# hex strings rather than growing a dictionary batch by batch.
+RESULT_ID_ENTITIES = {column: entity for column, entity in id_entities('sonar_results').items()
+                      if column in COLLECTION_MAPPINGS['sonar_results']['references']}
+
+
+# Command line options
+def parse_args(default_source='extended-json'):
+    parser = argparse.ArgumentParser(description="Extract the collections and load them into PostgreSQL")
+    parser.add_argument('--source', choices=SOURCES, default=default_source,
+                        help="where the collections are read from (default: %(default)s)")
+    parser.add_argument('--mode', choices=MODES, default='pipelined',
+                        help="how they are processed (default: %(default)s)")
+    parser.add_argument('--collections', default=COLLECTIONS_PATH, metavar='PATH',
+                        help="folder of the JSON dumps (<collection>.json, .json.gz or .json.zst) or a zip "
+                             "archive of them, e.g. collections.zip (default: %(default)s)")
+    parser.add_argument('--snapshot-origin', choices=[source for source in SOURCES if source != 'snapshot'],
+                        default='extended-json',
+                        help="source the snapshot is built from when it does not exist yet (default: %(default)s)")
+    parser.add_argument('--incremental', action='store_true',
+                        help="only pull sonar_runs/sonar_results past the stored watermarks (mongo source, "
+                             "pipelined mode)")
+    parser.add_argument('--workers', type=int, default=TRANSFORM_WORKERS,
+                        help="processes that transform and clean sonar_results in batch mode "
+                             "(default: %(default)s, in-process)")
+    parser.add_argument('--debug', action='store_true',
+                        help="print the DataFrame head()/info() dumps of transform and clean")
+    parser.add_argument('--report', default=RUN_REPORT_PATH,
+                        help="path of the JSON run report (default: %(default)s)")
+    parser.add_argument('--profile', metavar='STEP',
+                        help="run cProfile on one step of the run report, e.g. stage.clean or flatten.sonar_results")
+    parser.add_argument('--tracemalloc', metavar='STEP',
+                        help="trace the memory allocations of one step of the run report")
+    args = parser.parse_args()
+    if args.incremental and (args.source != 'mongo' or args.mode != 'pipelined'):
+        parser.error("--incremental needs --source mongo and --mode pipelined")
+    if args.incremental and args.workers > 1:
+        parser.error("--incremental needs --workers 1 (it runs the pipelined mode in-process)")
+    if args.mode == 'change-capture' and args.source != 'mongo':
+        parser.error("--mode change-capture needs --source mongo")
+    return args
+
+
+def main(default_source='extended-json'):
+    args = parse_args(default_source)
+    # Per-step timings go to the JSON run report; --profile/--tracemalloc hook one step
+    configure(args.profile, args.tracemalloc, args.debug)
+
+    username = "username" #provide your user name
+    password = "password"   #provide your pw
+    database_name = "Markt-Pilot" #provide your database name
+    collections_path = args.collections  # folder or zip archive of the JSON dumps
+    batch_size = EXTRACT_BATCH_SIZE  # documents per extracted batch
+    scan_segments = RANGE_SCAN_SEGMENTS  # parallel _id range scans over sonar_results, 1 for a single scan
+    transform_workers = args.workers  # sonar_results transform processes, scale with the host cores
+    workers = LOAD_WORKERS  # concurrent PostgreSQL load workers, scale with the database cores
+    commit_rows = COMMIT_CHUNK_ROWS  # rows per committed load chunk
+    commit_bytes = COMMIT_CHUNK_BYTES  # in-memory bytes per committed load chunk
+    results_partitions = SONAR_RESULTS_PARTITIONS  # hash partitions by part_id for a new sonar_results, 0 for none
+    id_storage_mode = ID_STORAGE  # 'bytea' stores the ObjectId keys of new tables as 12-byte bytea
+    key_cache_capacity = KEY_CACHE_CAPACITY  # run / supplier ids held exactly by the incremental and CDC key caches
+
+    # One PostgreSQL connection pool, sized for the workers, is shared by
+    # create_tables and every load; it is opened on first use
+    set_load_workers(workers)
+    # Loads commit chunk by chunk; an interrupted load resumes from
+    # collections/load_checkpoints.json on the next run
+    set_commit_chunk(commit_rows, commit_bytes)
+    set_sonar_results_partitions(results_partitions)
+    set_id_storage(id_storage_mode)
+    set_key_cache_capacity(key_cache_capacity)
+
+    def make_source(name, watermarks=None):
+        if name == 'mongo':
+            return MongoSource(username, password, database_name, batch_size, scan_segments, watermarks)
+        if name == 'native-json':
+            return NativeJsonSource(collections_path, batch_size)
+        if name == 'snapshot':
+            return SnapshotSource(make_source(args.snapshot_origin), batch_size=batch_size)
+        return JsonDumpSource(collections_path, batch_size)
+
+    try:
+        if args.mode == 'change-capture':
+            run_change_capture(make_source('mongo'))
+        elif args.mode == 'batch' or transform_workers > 1:
+            run_batch_pipeline(make_source(args.source), transform_workers)
+        else:
+            watermarks = load_watermarks() if args.incremental else None
+            run_pipelined(make_source(args.source, watermarks), watermarks)
+    finally:
+        close_pool()
+        write_run_report(args.report)
+
+
+# Batch pipeline: full extract, then transform, clean and load
+def run_batch_pipeline(source, transform_workers=TRANSFORM_WORKERS):
+    # sonar_results ids stay integer-coded until load time
+    id_encoder = IdEncoder()
+    parallel = transform_workers > 1 and not source.flattened
+    if parallel:
+        # sonar_results are extracted unparsed; the transform workers parse them
+        source.raw_collections = ('sonar_results',)
+    try:
+        with source:
+            # Extract
+            clients_data, suppliers_data, sonar_runs_data, sonar_results_data = extract_data(source)
+    except SOURCE_ERRORS as e:
+        print(f"An error occurred: {e}")
+        return
+
+    if parallel:
+        # Transform and clean sonar_results chunk by chunk in a process pool
+        clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, sonar_results_df = transform_clean_parallel(
+            source, clients_data, suppliers_data, sonar_runs_data, sonar_results_data, transform_workers, id_encoder
+        )
+    else:
+        # Transform
+        clients_df, suppliers_df, sonar_runs_df, sonar_results_df = transform_data(
+            source, clients_data, suppliers_data, sonar_runs_data, sonar_results_data
+        )
+
+        # Clean the data
+        clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, sonar_results_df = clean_data(
+            clients_df, suppliers_df, sonar_runs_df, sonar_results_df, id_encoder
+        )
+
+    create_tables()
+    # Load the data into PostgreSQL
+    if not sonar_results_df.empty:
+        load_to_postgresql(clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, sonar_results_df, id_encoder=id_encoder)
+    else:
+        print("No sonar results to load into PostgreSQL.")
+
+
+# Extract: read every batch of the given collections from an open source,
+# timed as step extract.<collection>. Returns one list of batches per
+# collection, in the order of collection_names. Raw collections
+# (Source.raw_collections) are unparsed chunks, so their rows are not counted.
+def extract_data(source, collection_names=COLLECTION_NAMES):
+    extracted = []
+    for collection_name in collection_names:
+        with step(f'extract.{collection_name}') as record:
+            batches = list(source.batches(collection_name))
+            if collection_name not in source.raw_collections:
+                record['rows_out'] = sum(len(batch) for batch in batches)
+        extracted.append(batches)
+    return tuple(extracted)
+
+
+# The batches of one collection as a single DataFrame with the target columns
+def collection_frame(source, collection_name, batches):
+    frames = [source.frame(collection_name, batch) for batch in batches]
+    if not frames:
+        return flatten_collection(collection_name, [])
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+
+# Transform: flatten the extracted batches into DataFrames
+def transform_data(source, clients, suppliers, sonar_runs, sonar_results):
+    clients_df = collection_frame(source, 'clients', clients)
+    suppliers_df = collection_frame(source, 'suppliers', suppliers)
+    sonar_runs_df = collection_frame(source, 'sonar_runs', sonar_runs)
+
+    # Display the DataFrames and their columns (--debug)
+    debug_frame("Clients DataFrame:", clients_df)
+    debug_frame("Suppliers DataFrame:", suppliers_df)
+    debug_frame("Sonar Runs DataFrame:", sonar_runs_df)
+
+    sonar_results_df = collection_frame(source, 'sonar_results', sonar_results)
+
+    # Debugging: Check if sonar_results_df is empty
+    if sonar_results_df.empty:
+        print(f"sonar_results_df is empty after transformation. Check the sonar_results of the {source.name} source.")
+
+    # Debugging: Check the final structure of the DataFrame (--debug)
+    debug_frame("Transformed sonar_results DataFrame:", sonar_results_df)
+    return clients_df, suppliers_df, sonar_runs_df, sonar_results_df
+
+
+# Pipelined run: the dimensions are extracted, cleaned and loaded first, then
+# sonar_results flows batch by batch through transform, clean and load so
+# peak memory is bounded by the batch size. With watermarks (incremental
+# mode) only the runs and results past them are pulled, and upserted.
+def run_pipelined(source, watermarks=None):
+    try:
+        with source:
+            clients_data, suppliers_data, sonar_runs_data = extract_data(source, DIMENSION_COLLECTIONS)
+            clients_df = collection_frame(source, 'clients', clients_data)
+            suppliers_df = collection_frame(source, 'suppliers', suppliers_data)
+            sonar_runs_df = collection_frame(source, 'sonar_runs', sonar_runs_data)
+            if watermarks is not None:
+                print(f"Extracted {len(sonar_runs_df)} sonar runs (watermark: {watermarks.get('sonar_runs')})")
+
+            return load_streamed_results(source, clients_df, suppliers_df, sonar_runs_df, watermarks)
+    except SOURCE_ERRORS as e:
+        print(f"An error occurred: {e}")
+
+
+# Clean and load the dimensions, then run sonar_results batch by batch
+# through the transform, clean and load stages as the source delivers them.
+# Returns the per-stage stats of the pipeline.
+def load_streamed_results(source, clients_df, suppliers_df, sonar_runs_df, watermarks=None):
+    incremental = watermarks is not None
+    id_encoder = IdEncoder()
+    clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, valid_suppliers, valid_sonar_run_ids = clean_dimensions(
+        clients_df, suppliers_df, sonar_runs_df, id_encoder
+    )
+
+    create_tables()
+    if incremental:
+        # New results may belong to runs and suppliers loaded by an earlier
+        # run; their keys are read once and checked batch by batch
+        supplier_keys, run_keys = dimension_key_caches()
+    upsert_tables = {'sonar_runs', 'sonar_results', 'price_history'} if incremental else ()
+    frames = dimension_frames(clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df)
+    _, dimensions_loaded, changed_dimensions = load_changed_dimensions(frames, upsert_tables=upsert_tables)
+    dates = run_dates(frames['sonar_runs'])
+
+    if incremental:
+        supplier_keys.add(suppliers_df['supplier_id'])
+        run_keys.add(dates.index, dates)
+        if sonar_runs_df['date'].notna().any():
+            latest_run_date = sonar_runs_df['date'].max()
+            previous_run_date = watermarks.get('sonar_runs')
+            if not dimensions_loaded:
+                # The runs are pulled again next time
+                print("Dimension load incomplete, sonar_runs watermark not advanced")
+            elif previous_run_date is None or latest_run_date > pd.Timestamp(previous_run_date):
+                watermarks['sonar_runs'] = latest_run_date.isoformat()
+                save_watermarks(watermarks)
+
+    # Smallest sonar_result_id loaded per (sonar_run_id, supplier_id) code
+    # pair, for dedup across batches; in incremental mode seeded with the
+    # stored results of each run as its first batch comes in
+    seen_pairs = {}
+    seeded_runs = set()
+    batch_numbers = itertools.count()
+    # sonar_run_id values of the loaded batches, for the rollup refresh
+    loaded_run_ids = []
+    # part_id values of the superseded results deleted, whose parts may have
+    # lost a result
+    superseded_part_ids = []
+    # Watermarks of the batches whose load did not fully commit; once there is
+    # one the sonar_results watermark stays before it, so the next
+    # incremental run pulls its results again
+    failed_batches = []
+
+    # Transform, clean and load run as concurrent stages linked by bounded queues
+    def transform(batch):
+        return source.frame('sonar_results', batch)
+
+    def clean(sonar_results_df):
+        batch_run_ids, batch_suppliers = valid_sonar_run_ids, valid_suppliers
+        if incremental:
+            batch_run_ids = id_encoder.encode_values('sonar_run', run_keys.lookup(sonar_results_df['sonar_run_id']).index)
+            batch_suppliers = id_encoder.encode_values('supplier', supplier_keys.lookup(sonar_results_df['supplier_id']).index)
+            seed_stored_pairs(seen_pairs, seeded_runs, sonar_results_df['sonar_run_id'], id_encoder)
+        return clean_sonar_results(
+            sonar_results_df, batch_run_ids, batch_suppliers, id_encoder,
+            seen_pairs=seen_pairs, append_rejected=next(batch_numbers) > 0
+        )
+
+    def load(sonar_results_df):
+        superseded = sonar_results_df.attrs.get('superseded', [])
+        if superseded:
+            superseded = pd.DataFrame(superseded, columns=['sonar_result_id', 'sonar_run_id'])
+            superseded_dates = run_keys.lookup(superseded['sonar_run_id']) if incremental else dates
+            deleted_part_ids = delete_results(superseded, superseded_dates)
+            if deleted_part_ids is None:
+                failed_batches.append(sonar_results_df.attrs.get('watermark'))
+            else:
+                superseded_part_ids.append(deleted_part_ids)
+        if not sonar_results_df.empty:
+            # Each batch is cut into chunks and committed by the load workers
+            results_frame = sonar_results_frame(sonar_results_df, id_encoder)
+            loaded_run_ids.append(results_frame['sonar_run_id'].drop_duplicates())
+            batch_dates = run_keys.lookup(results_frame['sonar_run_id']) if incremental else dates
+            _, complete = load_tables_parallel(
+                {'sonar_results': results_frame, **price_history_frames(results_frame, batch_dates)},
+                upsert_tables=upsert_tables
+            )
+            if not complete:
+                failed_batches.append(sonar_results_df.attrs.get('watermark'))
+                if incremental:
+                    print("Batch load incomplete, sonar_results watermark not advanced")
+        if incremental and not failed_batches and 'watermark' in sonar_results_df.attrs:
+            watermarks['sonar_results'] = sonar_results_df.attrs['watermark']
+            save_watermarks(watermarks)
+        return sonar_results_df
+
+    pipeline = Pipeline('extract', source.batches('sonar_results'), [
+        ('transform', transform),
+        ('clean', clean),
+        ('load', load),
+    ])
+    stage_stats = pipeline.run()
+    create_indexes()
+    refresh_rollups(pd.concat([frames['sonar_runs']['sonar_run_id'], *loaded_run_ids]),
+                    part_ids=pd.concat(superseded_part_ids) if superseded_part_ids else (),
+                    supplier_ids=changed_dimensions.get('suppliers_table', ()))
+    print(f"Loaded {stage_stats[-1]['rows_out']} sonar results into PostgreSQL.")
+    return stage_stats
+
+
+# Delete the sonar results of a frame of hex sonar_result_id and sonar_run_id
+# values, e.g. those a later batch superseded, with their price_history rows.
+# These are deleted by run date (from `dates`, by sonar_run_id) and id, so the
+# primary key and partition pruning apply. Returns the part_id of the
+# deleted results, for the rollup refresh, or None if the delete failed.
+def delete_results(results, dates):
+    history_keys = pd.DataFrame({
+        'run_date': pd.to_datetime(map_run_dates(results['sonar_run_id'], dates)).dt.strftime('%Y-%m-%d'),
+        'sonar_result_id': results['sonar_result_id'],
+    }).dropna()
+    try:
+        with pooled_connection() as conn, conn.cursor() as cursor:
+            if not history_keys.empty:
+                delete_keys(cursor, 'price_history', history_keys)
+            deleted = delete_keys(cursor, 'sonar_results', results[['sonar_result_id']], ['part_id'])
+        print(f"sonar_results: {len(deleted)} superseded rows deleted")
+        return deleted['part_id']
+    except Exception as e:
+        print(f"Error deleting superseded sonar results: {e}")
+        return None
+
+
+# The smallest stored sonar_result_id per (sonar_run_id, supplier_id) pair of
+# the given runs (hex ids), leaving out the results in `exclude`, read with
+# one query. Returns a frame of their hex ids.
+def stored_result_pairs(sonar_run_ids, exclude=()):
+    with step('clean.sonar_results.stored_pairs', rows_in=len(sonar_run_ids)) as record:
+        with pooled_connection() as conn, conn.cursor() as cursor:
+            binary = binary_columns(cursor, 'sonar_results')
+            cursor.execute(
+                "SELECT DISTINCT ON (sonar_run_id, supplier_id) sonar_run_id, supplier_id, sonar_result_id "
+                "FROM public.sonar_results WHERE sonar_run_id = ANY(%s) AND NOT sonar_result_id = ANY(%s) "
+                "ORDER BY sonar_run_id, supplier_id, sonar_result_id",
+                [[bytes.fromhex(key) for key in sonar_run_ids] if 'sonar_run_id' in binary else list(sonar_run_ids),
+                 [bytes.fromhex(key) for key in exclude] if 'sonar_result_id' in binary else list(exclude)]
+            )
+            rows = [[from_storage_id(value) for value in row] for row in cursor.fetchall()]
+        record['rows_out'] = len(rows)
+    return pd.DataFrame(rows, columns=['sonar_run_id', 'supplier_id', 'sonar_result_id'])
+
+
+# Seed seen_pairs (see clean_sonar_results) with the stored results of the
+# runs among sonar_run_ids (hex) that are not in seeded_runs yet, so results
+# are deduplicated against what earlier runs loaded as well. seeded_runs
+# collects the runs read; `exclude` are stored results about to be deleted.
+def seed_stored_pairs(seen_pairs, seeded_runs, sonar_run_ids, id_encoder, exclude=()):
+    sonar_run_ids = [run_id for run_id in pd.unique(sonar_run_ids.dropna()) if run_id not in seeded_runs]
+    if not sonar_run_ids:
+        return
+    stored = stored_result_pairs(sonar_run_ids, exclude)
+    pairs = pair_keys(id_encoder.encode_values('sonar_run', stored['sonar_run_id'].to_numpy(dtype=object)),
+                      id_encoder.encode_values('supplier', stored['supplier_id'].to_numpy(dtype=object)))
+    for pair, result_id in zip(pairs.tolist(), stored['sonar_result_id']):
+        if pair not in seen_pairs or result_id < seen_pairs[pair]:
+            seen_pairs[pair] = result_id
+    seeded_runs.update(sonar_run_ids)
+
+
+# Change-data-capture mode: tail the change streams of the four collections
+# and apply them micro-batch by micro-batch with the transform and clean rules
+# of the pipelined run. The resume token is saved after every fully applied
+# batch, so a restart continues right after it; changes replayed after a
+# crash are applied again as harmless upserts. A batch that is not fully
+# applied stops the capture before its token is saved, so the restart
+# replays it. Run a full load first: without a stored token only changes
+# from now on are captured.
+def run_change_capture(source, batch_size=CDC_BATCH_SIZE, batch_seconds=CDC_BATCH_SECONDS):
+    try:
+        db = source.connect()
+    except SOURCE_ERRORS as e:
+        print(f"An error occurred: {e}")
+        return
+
+    create_tables()
+    # Supplier ids and run dates already in PostgreSQL, kept current batch by batch
+    supplier_keys, run_keys = dimension_key_caches()
+
+    resume_token = load_watermarks(RESUME_TOKEN_FILE).get('resume_token')
+    print(f"Tailing change streams ({'resuming from the stored token' if resume_token else 'from now on'})")
+    try:
+        for batch in change_batches(db, resume_token, batch_size, batch_seconds):
+            with step('cdc.apply', rows_in=len(batch)):
+                applied = apply_change_batch(batch, supplier_keys, run_keys)
+            if not applied:
+                print("Change batch not fully applied; stopping at the last applied resume token, "
+                      "a restart replays the batch")
+                return
+            save_watermarks({'resume_token': batch.resume_token}, RESUME_TOKEN_FILE)
+    except KeyboardInterrupt:
+        print("Change capture stopped.")
+    except SOURCE_ERRORS as e:
+        print(f"An error occurred: {e}")
+
+
+# Apply one change_streams.ChangeBatch: upserted documents are flattened,
+# cleaned against the keys already loaded and upserted; deleted ids are
+# removed, dependent rows first. Upserted results are deduplicated against
+# the stored results of their runs too, and a stored result one of them
+# supersedes is deleted like a deleted one. A deleted run or supplier takes its
+# sonar_results (with their price_history rows) and its sonar_run_suppliers
+# links along, the rows clean_sonar_results rejects for an unknown run or
+# supplier; the runs of a deleted client are kept with client_id set to NULL.
+# supplier_keys and run_keys (KeyCaches of the loaded supplier ids and run
+# dates) are looked up for the ids the batch references and updated with
+# what it loads and deletes. Returns whether every load, delete and the
+# rollup refresh succeeded.
+def apply_change_batch(batch, supplier_keys, run_keys):
+    id_encoder = IdEncoder()
+    sonar_runs_df = flatten_collection('sonar_runs', batch.documents('sonar_runs'))
+    sonar_results_df = flatten_collection('sonar_results', batch.documents('sonar_results'))
+    link_field = COLLECTION_MAPPINGS['sonar_runs']['links'][0]
+    referenced_suppliers = supplier_keys.lookup(np.concatenate([
+        sonar_runs_df[link_field].explode().dropna().to_numpy(dtype=object),
+        sonar_results_df['supplier_id'].to_numpy(dtype=object),
+    ]))
+    clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, valid_suppliers, valid_sonar_run_ids = clean_dimensions(
+        flatten_collection('clients', batch.documents('clients')),
+        flatten_collection('suppliers', batch.documents('suppliers')),
+        sonar_runs_df,
+        id_encoder, known_suppliers=referenced_suppliers.index
+    )
+    frames = dimension_frames(clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df)
+    dates = run_dates(frames['sonar_runs']).combine_first(run_keys.lookup(sonar_results_df['sonar_run_id']))
+
+    valid_sonar_run_ids = np.union1d(
+        valid_sonar_run_ids, id_encoder.encode_values('sonar_run', dates.index.to_numpy(dtype=object))
+    )
+    # Loads and deletes that failed; the batch then counts as not applied
+    failures = []
+    # Results are deduplicated against the stored ones of their runs as well
+    seen_pairs = {}
+    try:
+        seed_stored_pairs(seen_pairs, set(), sonar_results_df['sonar_run_id'], id_encoder,
+                          exclude=batch.deleted_ids('sonar_results'))
+    except Exception as e:
+        # Without them no result can be told apart from a duplicate; the replay loads them
+        print(f"Error reading the stored sonar_results: {e}")
+        failures.append('read sonar_results')
+        sonar_results_df = sonar_results_df.iloc[:0]
+    sonar_results_df = clean_sonar_results(
+        sonar_results_df, valid_sonar_run_ids, valid_suppliers, id_encoder, seen_pairs=seen_pairs, append_rejected=True
+    )
+    superseded = pd.DataFrame(sonar_results_df.attrs['superseded'], columns=['sonar_result_id', 'sonar_run_id'])
+    frames['sonar_results'] = sonar_results_frame(sonar_results_df, id_encoder)
+    frames.update(price_history_frames(frames['sonar_results'], dates))
+    touched_runs = [frames['sonar_runs']['sonar_run_id'], frames['sonar_results']['sonar_run_id']]
+
+    def delete(table, keys, returning=None):
+        if keys.empty:
+            return pd.DataFrame(columns=returning or list(keys.columns))
+        try:
+            with pooled_connection() as conn, conn.cursor() as cursor:
+                deleted = delete_keys(cursor, table, keys, returning)
+            print(f"{table}: {len(deleted)} rows deleted")
+            return deleted
+        except Exception as e:
+            print(f"Error deleting from {table}: {e}")
+            failures.append(f'delete {table}')
+            return pd.DataFrame(columns=returning or list(keys.columns))
+
+    # The suppliers of an updated run are replaced, not merged
+    delete('sonar_run_suppliers', frames['sonar_runs'][['sonar_run_id']])
+    _, complete = load_tables_parallel({table: df for table, df in frames.items() if not df.empty},
+                                       upsert_tables=set(frames))
+    if not complete:
+        failures.append('load')
+    supplier_keys.add(suppliers_df['supplier_id'])
+    run_keys.add(frames['sonar_runs']['sonar_run_id'], frames['sonar_runs']['date'])
+
+    # Deletes run from the referencing tables to the referenced ones
+    deleted_run_ids = pd.DataFrame({'sonar_run_id': batch.deleted_ids('sonar_runs')})
+    deleted_supplier_ids = pd.DataFrame({'supplier_id': batch.deleted_ids('suppliers')})
+    deleted_client_ids = pd.DataFrame({'client_id': batch.deleted_ids('clients')})
+    result_columns = ['sonar_result_id', 'sonar_run_id', 'part_id', 'supplier_id']
+    deleted_results = pd.concat([
+        delete('sonar_results', pd.DataFrame({'sonar_result_id': batch.deleted_ids('sonar_results')}), result_columns),
+        delete('sonar_results', superseded[['sonar_result_id']], result_columns),
+        delete('sonar_results', deleted_run_ids, result_columns),
+        delete('sonar_results', deleted_supplier_ids, result_columns),
+    ], ignore_index=True)
+    history_keys = pd.DataFrame({
+        'run_date': pd.to_datetime(map_run_dates(deleted_results['sonar_run_id'],
+                                                 run_keys.lookup(deleted_results['sonar_run_id']))).dt.strftime('%Y-%m-%d'),
+        'sonar_result_id': deleted_results['sonar_result_id'],
+    }).dropna()
+    delete('price_history', history_keys)
+    touched_runs.append(deleted_results['sonar_run_id'])
+
+    delete('sonar_run_suppliers', deleted_run_ids)
+    delete('sonar_run_suppliers', deleted_supplier_ids)
+    deleted_runs = delete('sonar_runs', deleted_run_ids)
+    run_keys.discard(deleted_runs['sonar_run_id'])
+    deleted_suppliers = delete('suppliers_table', deleted_supplier_ids, ['supplier_id', 'country'])
+    supplier_keys.discard(deleted_suppliers['supplier_id'])
+    if not deleted_client_ids.empty:
+        try:
+            with pooled_connection() as conn, conn.cursor() as cursor:
+                detached = clear_references(cursor, 'sonar_runs', 'client_id', deleted_client_ids)
+            print(f"sonar_runs: {detached} runs detached from deleted clients")
+        except Exception as e:
+            print(f"Error detaching sonar_runs from deleted clients: {e}")
+            failures.append('detach sonar_runs')
+    delete('clients_table', deleted_client_ids)
+
+    # Deleted results no longer lead from their runs to their parts and
+    # suppliers, and an upserted supplier may have changed country
+    if not refresh_rollups(pd.concat(touched_runs), part_ids=deleted_results['part_id'],
+                           supplier_ids=pd.concat([suppliers_df['supplier_id'], deleted_results['supplier_id'],
+                                                   deleted_suppliers['supplier_id']]),
+                           countries=deleted_suppliers['country']):
+        failures.append('rollups')
+    print(f"Applied {len(batch)} changes: {len(frames['sonar_results'])} sonar results upserted, "
+          f"{len(deleted_results)} deleted")
+    if failures:
+        print(f"Change batch incomplete: {', '.join(failures)} failed")
+    return not failures
+
+
+# Key caches of the supplier ids and of the run dates by sonar_run_id already
+# in PostgreSQL, each warmed with one query
+def dimension_key_caches():
+    supplier_keys = KeyCache(COLLECTION_MAPPINGS['suppliers']['table'], COLLECTION_MAPPINGS['suppliers']['key'])
+    run_keys = KeyCache(COLLECTION_MAPPINGS['sonar_runs']['table'], COLLECTION_MAPPINGS['sonar_runs']['key'],
+                        'date', dtype='datetime64[us]')
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        supplier_keys.warm(cursor)
+        run_keys.warm(cursor)
+    return supplier_keys, run_keys
+
+
+# Clean the data. When the caller passes its IdEncoder the sonar_results id
+# columns are returned as int32 codes (decode them with the same encoder);
+# otherwise they are decoded back to hex strings here.
+def clean_data(clients_df, suppliers_df, sonar_runs_df, sonar_results_df, id_encoder=None):
+    decode_results = id_encoder is None
+    if id_encoder is None:
+        id_encoder = IdEncoder()
+
+    clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, valid_suppliers, valid_sonar_run_ids = clean_dimensions(
+        clients_df, suppliers_df, sonar_runs_df, id_encoder
+    )
+    sonar_results_df = clean_sonar_results(sonar_results_df, valid_sonar_run_ids, valid_suppliers, id_encoder)
+    if decode_results:
+        sonar_results_df = id_encoder.decode(sonar_results_df, RESULT_ID_ENTITIES)
+
+    # Final debug output (--debug)
+    debug_frame("After cleaning the data", sonar_results_df)
+
+    return clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, sonar_results_df
+
+
+# Drop the rows repeating the key of the collection mapping, timed as step
+# clean.<collection>.dedup, and parse its date columns
+def clean_collection(collection_name, df):
+    mapping = COLLECTION_MAPPINGS[collection_name]
+    with step(f'clean.{collection_name}.dedup', rows_in=len(df)) as record:
+        df = df.drop_duplicates(subset=[mapping['key']])
+        record['rows_out'] = len(df)
+
+    # Snapshots and dumps may still carry dates as strings
+    for kind, column in mapping['fields'].values():
+        if kind == 'date' and column in df.columns:
+            df[column] = pd.to_datetime(df[column], errors='coerce')
+    return df
+
+
+# Clean clients, suppliers and sonar runs. Returns them together with the
+# exploded (sonar_run_id, supplier_id) frame of the kept runs and the valid key
+# sets sonar_results are checked against, as codes of id_encoder.
+# known_suppliers: supplier ids already loaded, valid in addition to suppliers_df
+def clean_dimensions(clients_df, suppliers_df, sonar_runs_df, id_encoder, known_suppliers=None):
+    clients_df = clean_collection('clients', clients_df)
+    suppliers_df = clean_collection('suppliers', suppliers_df)
+    sonar_runs_df = clean_collection('sonar_runs', sonar_runs_df)
+    supplier_key = COLLECTION_MAPPINGS['suppliers']['key']
+    run_key = COLLECTION_MAPPINGS['sonar_runs']['key']
+    link_field, _, link_column = COLLECTION_MAPPINGS['sonar_runs']['links']
+
+    # Ensure foreign keys match between sonar runs and suppliers
+    valid_suppliers = suppliers_df[supplier_key].unique()
+    if known_suppliers is not None:
+        valid_suppliers = pd.unique(np.concatenate([valid_suppliers.astype(object), np.asarray(list(known_suppliers), dtype=object)]))
+    debug_print(f"Valid suppliers: {valid_suppliers}")
+
+    # One (sonar_run_id, supplier_id) row per supplier of each run
+    sonar_runs_df = sonar_runs_df.reset_index(drop=True)
+    sonar_run_suppliers_df = (
+        sonar_runs_df[[run_key, link_field]]
+        .explode(link_field)
+        .dropna(subset=[link_field])
+        .rename(columns={link_field: link_column})
+    )
+
+    # Debugging: supplier_ids format after extraction
+    debug_print(f"Sample extracted supplier_ids from sonar_runs_df: {sonar_run_suppliers_df.head(5)}")
+    print(f"Before supplier filtering, sonar_runs_df has {len(sonar_runs_df)} rows")
+
+    # Filter sonar_runs_df for valid suppliers: a run is kept when any of its
+    # suppliers is known, tested with one hash-based isin over the exploded pairs
+    with step('clean.sonar_runs.supplier_filter', rows_in=len(sonar_runs_df)) as record:
+        known_supplier = sonar_run_suppliers_df[link_column].isin(valid_suppliers)
+        has_known_supplier = known_supplier.groupby(level=0).any().reindex(sonar_runs_df.index, fill_value=False)
+        sonar_runs_df = sonar_runs_df[has_known_supplier]
+        sonar_run_suppliers_df = sonar_run_suppliers_df[sonar_run_suppliers_df.index.isin(sonar_runs_df.index)]
+        record['rows_out'] = len(sonar_runs_df)
+
+    print(f"After supplier filtering, sonar_runs_df has {len(sonar_runs_df)} rows")
+
+    # Clean sonar results data
+    valid_sonar_run_ids = sonar_runs_df[run_key].unique()
+    debug_print(f"Valid sonar run IDs: {valid_sonar_run_ids}")
+
+    # Key sets as integer codes in the shared supplier / sonar run code spaces
+    valid_suppliers = id_encoder.encode_values('supplier', valid_suppliers)
+    valid_sonar_run_ids = id_encoder.encode_values('sonar_run', valid_sonar_run_ids)
+
+    return clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, valid_suppliers, valid_sonar_run_ids
+
+
+# Clean one frame (or batch) of sonar results against the valid key sets,
+# following the references and dedup columns of its mapping. The id columns
+# are returned as int32 codes of id_encoder.
+# Of the results sharing a dedup pair (sonar_run_id, supplier_id) the one
+# with the smallest sonar_result_id is kept, whatever order they arrive in.
+# seen_pairs, when given, maps the code pairs kept by earlier batches (or
+# stored, see seed_stored_pairs) to their sonar_result_id so duplicates are
+# resolved across batches as well. A row with that same id is kept (it is
+# upserted); a row that beats the kept one is kept and the results it
+# supersedes are listed in attrs['superseded'] as (sonar_result_id,
+# sonar_run_id) hex pairs, for the caller to delete.
+def clean_sonar_results(sonar_results_df, valid_sonar_run_ids, valid_suppliers, id_encoder, seen_pairs=None, append_rejected=False):
+    mapping = COLLECTION_MAPPINGS['sonar_results']
+    valid_keys = {'sonar_runs': valid_sonar_run_ids, 'suppliers': valid_suppliers}
+
+    # Intern each ObjectId once; filtering and dedup below run on integer codes
+    sonar_results_df = id_encoder.encode(sonar_results_df, RESULT_ID_ENTITIES)
+
+    # Check if there are any null or problematic sonar_run_id entries before filtering
+    print(f"Before filtering, sonar_results_df has {len(sonar_results_df)} rows")
+
+    # Filter sonar_results_df on valid sonar_run_ids and supplier ids in one vectorized pass
+    with step('clean.sonar_results.references', rows_in=len(sonar_results_df)) as record:
+        sonar_results_df, rejected_results_df = filter_references(sonar_results_df, [
+            (column, valid_keys[collection_name], reason)
+            for column, (collection_name, reason) in mapping['references'].items()
+        ])
+        record['rows_out'] = len(sonar_results_df)
+    report_rejected_rows('sonar_results', id_encoder.decode(rejected_results_df, RESULT_ID_ENTITIES),
+                         append=append_rejected)
+
+    # Print the result after filtering
+    print(f"After filtering, sonar_results_df has {len(sonar_results_df)} rows")
+
+    # Handle duplicates
+    with step('clean.sonar_results.dedup', rows_in=len(sonar_results_df)) as record:
+        sonar_results_df = drop_duplicates_keep_smallest(sonar_results_df, mapping['dedup'], mapping['key'])
+        superseded = []
+        if seen_pairs is not None:
+            first, second = mapping['dedup']
+            pairs = pair_keys(sonar_results_df[first], sonar_results_df[second])
+            result_ids = sonar_results_df[mapping['key']].to_numpy(dtype=object)
+            previous = [seen_pairs.get(pair) for pair in pairs.tolist()]
+            keep = np.fromiter((kept_id is None or result_id <= kept_id
+                                for result_id, kept_id in zip(result_ids, previous)), dtype=bool, count=len(pairs))
+            replaces = keep & np.fromiter((kept_id is not None and kept_id != result_id
+                                           for result_id, kept_id in zip(result_ids, previous)), dtype=bool, count=len(pairs))
+            superseded = list(zip(np.array(previous, dtype=object)[replaces].tolist(),
+                                  id_encoder.decode_values('sonar_run', sonar_results_df[first].to_numpy()[replaces])))
+            sonar_results_df = sonar_results_df[keep]
+            seen_pairs.update(zip(pairs[keep].tolist(), result_ids[keep]))
+        record['rows_out'] = len(sonar_results_df)
+
+    sonar_results_df.attrs['superseded'] = superseded
+
+    return sonar_results_df
+
+
+# Parallel transform: the dimensions are flattened and cleaned here, while
+# the raw chunks of sonar_results are parsed, flattened, cleaned and encoded
+# with id_encoder's codes in a pool of `workers` processes. Returns the same
+# frames as clean_data, with the sonar_results ids integer-coded by id_encoder.
+def transform_clean_parallel(source, clients, suppliers, sonar_runs, sonar_results, workers, id_encoder):
+    clients_df = collection_frame(source, 'clients', clients)
+    suppliers_df = collection_frame(source, 'suppliers', suppliers)
+    sonar_runs_df = collection_frame(source, 'sonar_runs', sonar_runs)
+    clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, valid_suppliers, valid_sonar_run_ids = clean_dimensions(
+        clients_df, suppliers_df, sonar_runs_df, id_encoder
+    )
+
+    print(f"Transforming {len(sonar_results)} sonar_results chunks ({workers} workers)")
+    valid_keys = {'sonar_runs': (id_encoder.decode_values('sonar_run', valid_sonar_run_ids), valid_sonar_run_ids),
+                  'suppliers': (id_encoder.decode_values('supplier', valid_suppliers), valid_suppliers)}
+    with step('clean.sonar_results.parallel') as record:
+        sonar_results_df, rejected_results_df, documents = transform_sonar_results_parallel(
+            sonar_results, source.raw_format, valid_keys, workers
+        )
+        record['rows_out'] = len(sonar_results_df)
+    print(f"Before filtering, sonar_results had {documents} documents")
+    report_rejected_rows('sonar_results', rejected_results_df)
+    print(f"After cleaning, sonar_results_df has {len(sonar_results_df)} rows")
+    return clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, sonar_results_df
+
+
+def create_tables():
+    # Borrow a connection from the shared pool (settings in collections/config.json)
+    try:
+        pool = init_pool()
+        conn = pool.getconn()
+        conn.autocommit = True
+        cursor = conn.cursor()
+        print("Connection to PostgreSQL successful.")
+    except Exception as e:
+        print(f"Error connecting to PostgreSQL: {e}")
+        return
+
+    # ObjectId key columns are VARCHAR, or BYTEA in bytea id storage mode
+    id_type = id_column_type()
+
+    # SQL queries to create tables with error handling
+    try:
+        # Creating clients_table
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS public.clients_table (
+            client_id {id_type} PRIMARY KEY,
+            client_name VARCHAR,
+            contract_start TIMESTAMP
+        );
+        """)
+        print("clients_table created successfully.")
+    except Exception as e:
+        print(f"Error creating clients_table: {e}")
+
+    try:
+        # Creating suppliers_table
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS public.suppliers_table (
+            supplier_id {id_type} PRIMARY KEY,
+            supplier_name VARCHAR,
+            country VARCHAR  -- Adding country column
+        );
+        """)
+        print("suppliers_table created successfully.")
+    except Exception as e:
+        print(f"Error creating suppliers_table: {e}")
+
+    try:
+        # Creating sonar_runs_table
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS public.sonar_runs(
+            sonar_run_id {id_type} PRIMARY KEY,
+            status VARCHAR,
+            date TIMESTAMP,
+            client_id {id_type} REFERENCES clients_table(client_id)
+        );
+        """)
+        print("sonar_runs_table created successfully.")
+    except Exception as e:
+        print(f"Error creating sonar_runs_table: {e}")
+
+    try:
+        cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS public.sonar_run_suppliers(
+            sonar_run_supplier_id SERIAL PRIMARY KEY,
+            sonar_run_id {id_type},
+            supplier_id {id_type},
+            CONSTRAINT sonar_run_ids FOREIGN KEY (sonar_run_id)
+                REFERENCES public.sonar_runs (sonar_run_id) MATCH SIMPLE,
+            CONSTRAINT unique_sonar_run_supplier UNIQUE (sonar_run_id, supplier_id)  -- Add this unique constraint
+        );
+        """)
+        print("sonar_run_suppliers table created successfully.")
+    except Exception as e:
+        print(f"Error creating sonar_run_suppliers table: {e}")
+
+    try:
+        # Creating sonar_results_table, hash-partitioned by part_id if configured
+        if sonar_results_partitions():
+            create_partitioned_sonar_results(cursor)
+        else:
+            cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS public.sonar_results(
+            sonar_result_id {id_type},
+            sonar_run_id {id_type},
+            supplier_id {id_type},
+            price_norm numeric,
+            part_id {id_type},
+            CONSTRAINT sonar_results_pk PRIMARY KEY (sonar_result_id),
+            CONSTRAINT sonar_i_fk FOREIGN KEY (sonar_run_id)
+            REFERENCES public.sonar_runs (sonar_run_id) MATCH SIMPLE,
+            CONSTRAINT supply_id_fkey FOREIGN KEY (supplier_id)
+            REFERENCES public.suppliers_table (supplier_id) MATCH SIMPLE
+            ON UPDATE NO ACTION
+            ON DELETE NO ACTION
+             NOT VALID
+        );
+            """)
+        print("sonar_results_table created successfully.")
+    except Exception as e:
+        print(f"Error creating sonar_results_table: {e}")
+
+    try:
+        # Content hashes of the loaded clients and suppliers (see dimension_hashes.py)
+        create_dimension_hashes_table(cursor)
+        print("dimension_hashes table created successfully.")
+    except Exception as e:
+        print(f"Error creating dimension_hashes table: {e}")
+
+    try:
+        # Denormalised, yearly partitioned price history (see price_history.py)
+        create_price_history_table(cursor)
+        print("price_history table created successfully.")
+    except Exception as e:
+        print(f"Error creating price_history table: {e}")
+
+    try:
+        # Aggregate tables refreshed after each load (see rollups.py)
+        create_rollup_tables(cursor)
+        print("rollup tables created successfully.")
+    except Exception as e:
+        print(f"Error creating rollup tables: {e}")
+
+    if id_storage() == 'bytea':
+        try:
+            create_hex_views(cursor)
+            print("hex views created successfully.")
+        except Exception as e:
+            print(f"Error creating hex views: {e}")
+
+    # Check if tables exist after creation
+    tables = ['clients_table', 'suppliers_table', 'sonar_runs', 'sonar_results','sonar_run_suppliers']
+    for table in tables:
+        try:
+            cursor.execute(sql.SQL("SELECT EXISTS (SELECT FROM information_schema.tables WHERE table_name = %s);"), [table])
+            table_exists = cursor.fetchone()[0]
+            if table_exists:
+                print(f"{table} exists.")
+            else:
+                print(f"{table} does not exist.")
+        except Exception as e:
+            print(f"Error checking table existence for {table}: {e}")
+
+    # Return the connection to the pool
+    cursor.close()
+    conn.autocommit = False
+    pool.putconn(conn)
+
+
+# Load data into PostgreSQL
+def load_to_postgresql(clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, sonar_results_df, bulk=True, id_encoder=None):
+    # Integer-coded ids from clean_data go back to their hex form here
+    if id_encoder is not None:
+        sonar_results_df = id_encoder.decode(sonar_results_df, RESULT_ID_ENTITIES)
+
+    # Check for empty DataFrames and print appropriate messages
+    if clients_df.empty:
+        print("Client DataFrame is empty")
+    if suppliers_df.empty:
+        print("Supplier DataFrame is empty")
+    if sonar_runs_df.empty:
+        print("Sonar Runs DataFrame is empty")
+    if sonar_results_df.empty:
+        print("Sonar Results DataFrame is empty")
+
+    # Bulk mode: COPY each table into staging and insert it set-based,
+    # independent tables concurrently on pooled connections. The row-by-row
+    # inserts pass ids as text, so bytea id storage always loads in bulk.
+    if bulk or id_storage() == 'bytea':
+        return bulk_load_tables(clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, sonar_results_df)
+
+    frames = dimension_frames(clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df)
+    frames['sonar_results'] = sonar_results_frame(sonar_results_df)
+
+    # Borrow a database connection from the pool and insert the tables in
+    # their load order, row by row
+    pool = init_pool()
+    conn = pool.getconn()
+    cursor = conn.cursor()
+    for stage in LOAD_STAGES:
+        for table in stage:
+            if table in frames:
+                insert_rows(conn, cursor, table, frames[table])
+
+    # Commit changes, close the cursor and return the connection
+    conn.commit()
+    cursor.close()
+    pool.putconn(conn)
+    # The price history is always bulk loaded from the frames in memory
+    load_tables_parallel(price_history_frames(frames['sonar_results'], run_dates(frames['sonar_runs'])))
+    create_indexes()
+    refresh_rollups(pd.concat([frames['sonar_runs']['sonar_run_id'], frames['sonar_results']['sonar_run_id']]))
+
+
+# Insert one table row by row with ON CONFLICT DO NOTHING, committing every
+# chunk so the server never holds the whole table in one transaction
+def insert_rows(conn, cursor, table, df):
+    columns, _ = BULK_TABLES[table]
+    key = conflict_columns(cursor, table)
+    statement = sql.SQL("INSERT INTO public.{} ({}) VALUES ({}) ON CONFLICT ({}) DO NOTHING").format(
+        sql.Identifier(table),
+        sql.SQL(', ').join(map(sql.Identifier, columns)),
+        sql.SQL(', ').join(sql.Placeholder() * len(columns)),
+        sql.SQL(', ').join(map(sql.Identifier, key))
+    )
+    with step(f'load.{table}', rows_in=len(df)):
+        chunk_rows = commit_chunk_rows(df)
+        for position, row in enumerate(df[columns].itertuples(index=False, name=None), 1):
+            try:
+                cursor.execute(statement, row)
+                debug_print(f"Inserted into {table}: {row}")
+            except Exception as e:
+                print(f"Error inserting into {table} at row {position}: {e}")
+            if position % chunk_rows == 0:
+                conn.commit()
+
+
+# Bulk load every table with COPY + INSERT ... SELECT ... ON CONFLICT DO NOTHING
+def bulk_load_tables(clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df, sonar_results_df, workers=None):
+    frames = dimension_frames(clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df)
+    frames['sonar_results'] = sonar_results_frame(sonar_results_df)
+    # The price history is built from the frames in memory and loaded with them
+    frames.update(price_history_frames(frames['sonar_results'], run_dates(frames['sonar_runs'])))
+    # Only new or changed clients and suppliers are sent
+    stats, _, changed_dimensions = load_changed_dimensions(frames, workers)
+    # Secondary indexes are built once the data is in
+    create_indexes()
+    # Only the rollup rows the runs and changed suppliers of this load
+    # contribute to are recomputed
+    refresh_rollups(pd.concat([frames['sonar_runs']['sonar_run_id'], frames['sonar_results']['sonar_run_id']]),
+                    supplier_ids=changed_dimensions.get('suppliers_table', ()))
+    return stats
+
+
+# Cleaned clients, suppliers, sonar_runs and sonar_run_suppliers by target
+# table; they already carry the target columns of bulk_load.BULK_TABLES
+def dimension_frames(clients_df, suppliers_df, sonar_runs_df, sonar_run_suppliers_df):
+    return {
+        COLLECTION_MAPPINGS['clients']['table']: clients_df,
+        COLLECTION_MAPPINGS['suppliers']['table']: suppliers_df,
+        COLLECTION_MAPPINGS['sonar_runs']['table']: sonar_runs_df,
+        # The exploded pairs from clean_dimensions are loaded as they are
+        COLLECTION_MAPPINGS['sonar_runs']['links'][1]: sonar_run_suppliers_df,
+    }
+
+
+# One frame (or batch) of cleaned sonar results; id_encoder decodes
+# integer-coded id columns first
+def sonar_results_frame(sonar_results_df, id_encoder=None):
+    if id_encoder is not None:
+        sonar_results_df = id_encoder.decode(sonar_results_df, RESULT_ID_ENTITIES)
+    # Referential filtering already happened in clean_data
+    return sonar_results_df
+
+
+if __name__ == "__main__":
+    main()
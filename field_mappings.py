@@ -0,0 +1,97 @@
+# Declarative mapping of every collection the pipeline reads, used by the
+# flattening, the cleaning and the load alike:
+#   table       target table in PostgreSQL
+#   key         target column the collection is deduplicated on
+#   fields      source field -> (kind, target column); kinds as in flatten.py
+#   links       id_list field exploded into an association table of
+#               (key, <id column>) pairs, as (field, table, id column)
+#   references  target column -> (collection, rejected reason); rows whose
+#               value is not a key of that collection are rejected
+#   dedup       target columns duplicates are dropped on, first row kept
+# Adding a field to a collection is a change here plus the table DDL.
+COLLECTION_MAPPINGS = {
+    'clients': {
+        'table': 'clients_table',
+        'key': 'client_id',
+        'fields': {
+            '_id': ('id', 'client_id'),
+            'name': ('str', 'client_name'),
+            'contract_start': ('date', 'contract_start'),
+        },
+    },
+    'suppliers': {
+        'table': 'suppliers_table',
+        'key': 'supplier_id',
+        'fields': {
+            '_id': ('id', 'supplier_id'),
+            'name': ('str', 'supplier_name'),
+            'country': ('str', 'country'),
+        },
+    },
+    'sonar_runs': {
+        'table': 'sonar_runs',
+        'key': 'sonar_run_id',
+        'fields': {
+            '_id': ('id', 'sonar_run_id'),
+            'date': ('date', 'date'),
+            'status': ('str', 'status'),
+            'client_id': ('id', 'client_id'),
+            'supplier_ids': ('id_list', 'supplier_ids'),
+        },
+        'links': ('supplier_ids', 'sonar_run_suppliers', 'supplier_id'),
+    },
+    'sonar_results': {
+        'table': 'sonar_results',
+        'key': 'sonar_result_id',
+        'fields': {
+            '_id': ('id', 'sonar_result_id'),
+            'sonar_run_id': ('id', 'sonar_run_id'),
+            'supplier_id': ('id', 'supplier_id'),
+            'part_id': ('id', 'part_id'),
+            'price_norm': ('float', 'price_norm'),
+        },
+        'references': {
+            'sonar_run_id': ('sonar_runs', 'unknown sonar_run_id'),
+            'supplier_id': ('suppliers', 'unknown supplier_id'),
+        },
+        'dedup': ['sonar_run_id', 'supplier_id'],
+    },
+}
+
+
+# field -> kind, the document shape flatten.py builds columns from
+def collection_schema(collection_name):
+    return {field: kind for field, (kind, _) in COLLECTION_MAPPINGS[collection_name]['fields'].items()}
+
+
+# Source fields of a collection, e.g. for a find() projection
+def source_fields(collection_name):
+    return list(COLLECTION_MAPPINGS[collection_name]['fields'])
+
+
+# Flattened column name -> target column. The json_normalize style names
+# ('_id.$oid', 'date.$date') are mapped as well, so frames and snapshots
+# written by earlier versions are renamed the same way.
+def target_columns(collection_name):
+    columns = {}
+    for field, (kind, column) in COLLECTION_MAPPINGS[collection_name]['fields'].items():
+        columns[field] = column
+        if kind == 'id':
+            columns[f'{field}.$oid'] = column
+        elif kind == 'date':
+            columns[f'{field}.$date'] = column
+    return columns
+
+
+# Target id column -> entity code space of id_codes.IdEncoder ('supplier_id'
+# -> 'supplier'), so the same entity shares its codes across collections
+def id_entities(collection_name):
+    return {
+        column: column[:-len('_id')]
+        for kind, column in COLLECTION_MAPPINGS[collection_name]['fields'].values()
+        if kind == 'id'
+    }
+
+
+def key_entity(collection_name):
+    return id_entities(collection_name)[COLLECTION_MAPPINGS[collection_name]['key']]
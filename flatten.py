@@ -0,0 +1,75 @@
+import pandas as pd
+from field_mappings import COLLECTION_MAPPINGS, collection_schema, target_columns
+from instrumentation import step
+
+# Known document shape of each collection: field -> kind, taken from the
+# field mappings. Kinds: 'id' (ObjectId), 'id_list' (array of ObjectIds),
+# 'date', 'str', 'float'
+COLLECTION_SCHEMAS = {collection_name: collection_schema(collection_name) for collection_name in COLLECTION_MAPPINGS}
+
+
+# ObjectId, Extended-JSON {"$oid": ...} or hex string -> 24-char hex string
+def unwrap_id(value):
+    if isinstance(value, dict):
+        return value.get('$oid')
+    if value is None:
+        return None
+    return str(value)
+
+
+# datetime, ISO string, {"$date": "..."} or {"$date": {"$numberLong": "..."}}
+# -> something pd.to_datetime understands
+def unwrap_date(value):
+    if isinstance(value, dict):
+        value = value.get('$date')
+        if isinstance(value, dict):
+            return pd.Timestamp(int(value['$numberLong']), unit='ms')
+    return value
+
+
+# Column name a field gets: bare for native documents, json_normalize style
+# ('_id.$oid', 'date.$date') when extended_names is set
+def column_name(field, kind, extended_names):
+    if extended_names and kind == 'id':
+        return f'{field}.$oid'
+    if extended_names and kind == 'date':
+        return f'{field}.$date'
+    return field
+
+
+# Schema-driven replacement for pd.json_normalize on the known collections.
+# Accepts Mongo-native documents and Extended-JSON ($oid/$date) documents
+# alike and builds typed columns directly: ObjectIds as hex strings, dates as
+# naive UTC datetime64, prices as float64, supplier_ids as lists of hex strings.
+def flatten_documents(collection_name, documents, extended_names=False):
+    with step(f'flatten.{collection_name}', rows_in=len(documents)) as record:
+        df = build_columns(collection_name, documents, extended_names)
+        record['rows_out'] = len(df)
+    return df
+
+
+# flatten_documents with the columns renamed to the target columns of the
+# collection mapping ('_id' -> 'client_id', 'name' -> 'client_name', ...)
+def flatten_collection(collection_name, documents):
+    return flatten_documents(collection_name, documents).rename(columns=target_columns(collection_name))
+
+
+def build_columns(collection_name, documents, extended_names):
+    columns = {}
+    for field, kind in COLLECTION_SCHEMAS[collection_name].items():
+        values = [document.get(field) for document in documents]
+
+        if kind == 'id':
+            column = [unwrap_id(value) for value in values]
+        elif kind == 'id_list':
+            column = [[unwrap_id(item) for item in value] if isinstance(value, list) else [] for value in values]
+        elif kind == 'date':
+            column = pd.to_datetime([unwrap_date(value) for value in values], errors='coerce', utc=True).tz_convert(None)
+        elif kind == 'float':
+            column = pd.to_numeric(pd.Series(values, dtype=object), errors='coerce').astype('float64')
+        else:
+            column = values
+
+        columns[column_name(field, kind, extended_names)] = column
+
+    return pd.DataFrame(columns)
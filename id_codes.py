@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+
+# Code used for a missing id
+NULL_CODE = -1
+
+
+# Interns the ObjectId hex strings of one entity (suppliers, sonar runs)
+# into dense int32 codes: the code of an id is its position in `ids`. A
+# column is encoded vectorised, its distinct values looked up with
+# Index.get_indexer and the new ones appended; after that filters, dedup and
+# joins can work on the integer codes.
+class IdDictionary:
+    def __init__(self):
+        self.ids = pd.Index([], dtype=object)
+        self._id_array = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    # Encode a column of ids; only the distinct values of the column touch the dictionary
+    def encode(self, values):
+        local_codes, uniques = pd.factorize(np.asarray(values, dtype=object))
+        if len(uniques) == 0:
+            return np.full(len(local_codes), NULL_CODE, dtype=np.int32)
+        unique_codes = self.ids.get_indexer(uniques)
+        new = unique_codes < 0
+        if new.any():
+            unique_codes[new] = np.arange(len(self.ids), len(self.ids) + int(new.sum()))
+            self.ids = self.ids.append(pd.Index(uniques[new], dtype=object))
+            self._id_array = None
+        return np.where(local_codes >= 0, unique_codes[local_codes], NULL_CODE).astype(np.int32)
+
+    def decode(self, codes):
+        if self._id_array is None:
+            self._id_array = np.append(self.ids.to_numpy(dtype=object), None)
+        codes = np.asarray(codes)
+        # NULL_CODE indexes the trailing None
+        return self._id_array[np.where(codes >= 0, codes, len(self.ids))]
+
+
+# One IdDictionary per entity, so e.g. suppliers._id, sonar_results.supplier_id
+# and sonar_runs.supplier_ids all share the supplier code space
+class IdEncoder:
+    def __init__(self):
+        self.dictionaries = {}
+
+    def dictionary(self, entity):
+        if entity not in self.dictionaries:
+            self.dictionaries[entity] = IdDictionary()
+        return self.dictionaries[entity]
+
+    def encode_values(self, entity, values):
+        return self.dictionary(entity).encode(values)
+
+    def decode_values(self, entity, codes):
+        return self.dictionary(entity).decode(codes)
+
+    # Replace id columns ({column: entity}) with their int32 codes
+    def encode(self, df, column_entities):
+        df = df.copy()
+        for column, entity in column_entities.items():
+            if column in df.columns:
+                df[column] = self.encode_values(entity, df[column].to_numpy(dtype=object))
+        return df
+
+    # Replace code columns ({column: entity}) with the original hex ids
+    def decode(self, df, column_entities):
+        df = df.copy()
+        for column, entity in column_entities.items():
+            if column in df.columns:
+                df[column] = self.decode_values(entity, df[column].to_numpy())
+        return df
+
+
+# Combine two int32 code columns into one int64 key for pair dedup and joins
+def pair_keys(left_codes, right_codes):
+    return (np.asarray(left_codes, dtype=np.int64) << 32) | (np.asarray(right_codes, dtype=np.int64) & 0xFFFFFFFF)
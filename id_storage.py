@@ -0,0 +1,89 @@
+import threading
+from psycopg2 import sql
+
+# How create_tables stores the ObjectId keys: 'varchar' keeps the 24-character
+# hex strings, 'bytea' stores the 12 raw bytes (half the size in every table
+# and index, and faster joins). The mode only applies to tables that do not
+# exist yet; drop the tables to switch an existing database.
+ID_STORAGE = 'varchar'
+ID_COLUMN_TYPES = {'varchar': 'VARCHAR', 'bytea': 'BYTEA'}
+
+# Tables given a <table>_hex view in bytea mode
+HEX_VIEW_TABLES = [
+    'clients_table', 'suppliers_table', 'sonar_runs', 'sonar_run_suppliers', 'sonar_results',
+    'part_result_counts', 'supplier_result_counts', 'part_daily_prices', 'price_history',
+]
+
+_id_storage = ID_STORAGE
+
+# bytea columns of each loaded table, read from the database once
+_binary_columns = {}
+_binary_columns_lock = threading.Lock()
+
+
+def set_id_storage(mode=ID_STORAGE):
+    global _id_storage
+    if mode not in ID_COLUMN_TYPES:
+        raise ValueError(f"Unknown id storage {mode!r}, expected one of {sorted(ID_COLUMN_TYPES)}")
+    _id_storage = mode
+
+
+def id_storage():
+    return _id_storage
+
+
+# Column type of the ObjectId keys in the CREATE TABLE statements
+def id_column_type():
+    return ID_COLUMN_TYPES[_id_storage]
+
+
+def binary_columns(cursor, table):
+    with _binary_columns_lock:
+        if table not in _binary_columns:
+            cursor.execute(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = 'public' AND table_name = %s AND data_type = 'bytea'", [table]
+            )
+            _binary_columns[table] = [row[0] for row in cursor.fetchall()]
+        return _binary_columns[table]
+
+
+# Hex ids -> bytea input ('\x' + hex) for the columns of `table` that are
+# bytea in the database, one vectorised string operation per column. Driven
+# by the actual column types, so a table created in the other mode still
+# loads correctly.
+def to_storage_ids(cursor, df, table):
+    columns = [column for column in binary_columns(cursor, table) if column in df.columns]
+    if not columns:
+        return df
+    df = df.copy()
+    for column in columns:
+        df[column] = '\\x' + df[column]
+    return df
+
+
+# Stored key back to the hex form; bytea values arrive as memoryview
+def from_storage_id(value):
+    return bytes(value).hex() if isinstance(value, (memoryview, bytes)) else value
+
+
+# <table>_hex views showing every bytea column as its hex ObjectId, so
+# queries written against the varchar schema keep working on the views
+def create_hex_views(cursor, tables=HEX_VIEW_TABLES):
+    for table in tables:
+        cursor.execute(
+            "SELECT column_name, data_type FROM information_schema.columns "
+            "WHERE table_schema = 'public' AND table_name = %s ORDER BY ordinal_position", [table]
+        )
+        columns = cursor.fetchall()
+        if not columns:
+            continue
+        cursor.execute(sql.SQL("CREATE OR REPLACE VIEW public.{} AS SELECT {} FROM public.{}").format(
+            sql.Identifier(f'{table}_hex'),
+            sql.SQL(', ').join(
+                sql.SQL("encode({0}, 'hex') AS {0}").format(sql.Identifier(column)) if data_type == 'bytea'
+                else sql.Identifier(column)
+                for column, data_type in columns
+            ),
+            sql.Identifier(table)
+        ))
@@ -0,0 +1,190 @@
+import io
+import os
+import sys
+import json
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+from datetime import datetime, timezone
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # not available on Windows; peak RSS is then left out
+    resource = None
+
+# Default location of the JSON run report
+RUN_REPORT_PATH = os.path.join('collections', 'run_report.json')
+
+# Per-step records of the current run, keyed by step name. Steps that run
+# once per batch are aggregated into one record with a call count.
+_steps = {}
+_pipelines = []
+_lock = threading.Lock()
+_started = time.perf_counter()
+_started_at = datetime.now(timezone.utc)
+
+# Optional hooks on a single step and the opt-in debug dumps
+_profile_step = None
+_profiler = None
+_profiling = False
+_profiled_calls = 0
+_tracemalloc_step = None
+_tracemalloc_top = None
+_debug = False
+
+
+# Profile one step with cProfile and/or trace the allocations of one step
+# with tracemalloc (step names as they appear in the run report)
+def configure(profile_step=None, tracemalloc_step=None, debug=False):
+    global _profile_step, _profiler, _profiled_calls, _tracemalloc_step, _debug
+    _profile_step = profile_step
+    _profiler = cProfile.Profile() if profile_step else None
+    _profiled_calls = 0
+    _tracemalloc_step = tracemalloc_step
+    _debug = debug
+    if tracemalloc_step and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def debug_enabled():
+    return _debug
+
+
+# The df.head()/df.info() dumps are expensive on big frames and only shown with --debug
+def debug_frame(title, df):
+    if _debug:
+        print(title)
+        print(df.head())
+        df.info()
+
+
+def debug_print(message):
+    if _debug:
+        print(message)
+
+
+# Process peak resident set size in bytes, or None where it cannot be read
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# Time one step. The yielded dict takes the output row count as
+# record['rows_out']; rows dropped is rows_in - rows_out. CPU time is that of
+# the calling thread, so concurrent stages do not count each other's work.
+@contextmanager
+def step(name, rows_in=None):
+    global _profiling, _profiled_calls
+    record = {'rows_out': None}
+    with _lock:
+        # One profiler can only be active once; concurrent calls of the step run unprofiled
+        profiling = _profiler is not None and name == _profile_step and not _profiling
+        _profiling = _profiling or profiling
+        _profiled_calls += profiling
+    tracing = name == _tracemalloc_step and tracemalloc.is_tracing()
+    if tracing:
+        start_snapshot = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+    if profiling:
+        _profiler.enable()
+    wall_start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield record
+    finally:
+        wall_seconds = time.perf_counter() - wall_start
+        cpu_seconds = time.thread_time() - cpu_start
+        if profiling:
+            _profiler.disable()
+            _profiling = False
+        traced_peak = None
+        if tracing:
+            traced_peak = tracemalloc.get_traced_memory()[1]
+            _keep_allocation_top(traced_peak, start_snapshot)
+        _record_step(name, wall_seconds, cpu_seconds, rows_in, record['rows_out'], traced_peak)
+
+
+# Keep the allocations made by the call of the traced step with the highest peak
+def _keep_allocation_top(traced_peak, start_snapshot):
+    global _tracemalloc_top
+    if _tracemalloc_top is None or traced_peak >= _tracemalloc_top[0]:
+        top = tracemalloc.take_snapshot().compare_to(start_snapshot, 'lineno')[:10]
+        _tracemalloc_top = (traced_peak, [str(line) for line in top])
+
+
+def _record_step(name, wall_seconds, cpu_seconds, rows_in, rows_out, traced_peak=None):
+    with _lock:
+        record = _steps.setdefault(name, {
+            'step': name, 'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+            'rows_in': None, 'rows_out': None, 'rows_dropped': None, 'process_peak_rss_bytes': None,
+        })
+        record['calls'] += 1
+        record['wall_seconds'] += wall_seconds
+        record['cpu_seconds'] += cpu_seconds
+        if rows_in is not None:
+            record['rows_in'] = (record['rows_in'] or 0) + rows_in
+        if rows_out is not None:
+            record['rows_out'] = (record['rows_out'] or 0) + rows_out
+        if record['rows_in'] is not None and record['rows_out'] is not None:
+            record['rows_dropped'] = record['rows_in'] - record['rows_out']
+        # ru_maxrss is the peak of the whole process so far, not of the step
+        record['process_peak_rss_bytes'] = peak_rss_bytes()
+        if traced_peak is not None:
+            record['traced_peak_bytes'] = max(record.get('traced_peak_bytes', 0), traced_peak)
+
+
+# Per-stage stats of a pipeline_stages.Pipeline run
+def record_pipeline(stage_stats):
+    with _lock:
+        _pipelines.append(stage_stats)
+
+
+def run_report():
+    with _lock:
+        report = {
+            'started_at': _started_at.isoformat(),
+            'wall_seconds': time.perf_counter() - _started,
+            'cpu_seconds': time.process_time(),
+            'peak_rss_bytes': peak_rss_bytes(),
+            'steps': [dict(record) for record in _steps.values()],
+            'pipelines': list(_pipelines),
+        }
+    # pstats cannot read a profiler that was never enabled, e.g. when the
+    # step name has a typo or the step did not run
+    if _profiler is not None and _profiled_calls:
+        buffer = io.StringIO()
+        pstats.Stats(_profiler, stream=buffer).sort_stats('cumulative').print_stats(25)
+        report['profile'] = {'step': _profile_step, 'calls': _profiled_calls, 'stats': buffer.getvalue()}
+    elif _profiler is not None:
+        report['profile'] = {'step': _profile_step, 'calls': 0, 'stats': None}
+    if _tracemalloc_top is not None:
+        report['tracemalloc'] = {'step': _tracemalloc_step, 'peak_bytes': _tracemalloc_top[0],
+                                 'top_allocations': _tracemalloc_top[1]}
+    return report
+
+
+# Print a per-step summary and write the report as JSON
+def write_run_report(file_path=RUN_REPORT_PATH):
+    report = run_report()
+    print(f"{'step':<36}{'calls':>7}{'wall':>10}{'cpu':>10}{'rows in':>11}{'rows out':>11}{'dropped':>9}")
+    for record in report['steps']:
+        rows = [record[key] if record[key] is not None else '-' for key in ('rows_in', 'rows_out', 'rows_dropped')]
+        print(f"{record['step']:<36}{record['calls']:>7}{record['wall_seconds']:>9.2f}s{record['cpu_seconds']:>9.2f}s"
+              f"{rows[0]:>11}{rows[1]:>11}{rows[2]:>9}")
+    if 'profile' in report and report['profile']['stats'] is None:
+        print(f"cProfile: step {report['profile']['step']} was not run")
+    elif 'profile' in report:
+        print(f"cProfile of {report['profile']['step']}:")
+        print(report['profile']['stats'])
+
+    os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+    with open(file_path, 'w') as f:
+        json.dump(report, f, indent=4, default=str)
+    print(f"Run report written to {file_path}")
+    return report
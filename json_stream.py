@@ -0,0 +1,111 @@
+import json
+import numpy as np
+
+try:
+    import orjson
+except ImportError:  # the standard library parser is used instead
+    orjson = None
+
+# Bytes read from a dump at a time; the parse of one chunk is the peak memory
+READ_CHUNK_BYTES = 4 * 2 ** 20
+
+# Parser of the documents: 'orjson' when installed (several times faster),
+# otherwise 'json'
+JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+_QUOTE, _BACKSLASH = ord('"'), ord('\\')
+_OPENS, _CLOSES = (ord('{'), ord('[')), (ord('}'), ord(']'))
+
+
+def parse_json(data, backend=JSON_BACKEND):
+    return orjson.loads(data) if backend == 'orjson' else json.loads(data)
+
+
+# Find the complete elements of a top-level JSON array in `buffer`, which
+# starts inside the array (after '[' or after an element). Vectorised over
+# the sparse quote and bracket positions: a quote counts unless an odd run
+# of backslashes escapes it, a bracket is structural when an even number of
+# quotes precedes it, and the running sum of the structural brackets is the
+# nesting depth. Returns the start and end offsets of the complete
+# object/array elements, and the offset of the closing ']' of the array, or
+# None if it is not in the buffer.
+def element_bounds(buffer):
+    data = np.frombuffer(buffer, dtype=np.uint8)
+
+    quotes = np.flatnonzero(data == _QUOTE)
+    escapable = np.flatnonzero((quotes > 0) & (data[np.maximum(quotes - 1, 0)] == _BACKSLASH))
+    if len(escapable):
+        # Escaped quotes are rare; their backslash runs are counted one by one
+        escaped = np.zeros(len(quotes), dtype=bool)
+        for index in escapable:
+            position = quotes[index] - 1
+            while position >= 0 and data[position] == _BACKSLASH:
+                position -= 1
+            escaped[index] = (quotes[index] - 1 - position) % 2 == 1
+        quotes = quotes[~escaped]
+
+    brackets = np.flatnonzero((data == _OPENS[0]) | (data == _OPENS[1]) | (data == _CLOSES[0]) | (data == _CLOSES[1]))
+    brackets = brackets[np.searchsorted(quotes, brackets) % 2 == 0]
+    kinds = data[brackets]
+    opens = (kinds == _OPENS[0]) | (kinds == _OPENS[1])
+    depth = 1 + np.cumsum(np.where(opens, 1, -1), dtype=np.int64)
+
+    array_end = np.flatnonzero(~opens & (depth == 0))
+    array_end = int(brackets[array_end[0]]) if len(array_end) else None
+    starts = brackets[opens & (depth == 2)]
+    ends = brackets[~opens & (depth == 1)]
+    if array_end is not None:
+        starts = starts[starts < array_end]
+        ends = ends[ends < array_end]
+    return starts[:len(ends)], ends, array_end
+
+
+# Incrementally read the top-level array of a JSON dump (a binary file) and
+# yield its complete elements chunk by chunk, unparsed, as JSON arrays
+# (bytes) of about chunk_bytes each. Only one chunk plus the document it
+# cuts through is held at a time, so dumps of any size stream through in
+# bounded memory. The array elements must be objects (or arrays), as in the
+# collection dumps.
+def iter_json_chunks(file, chunk_bytes=READ_CHUNK_BYTES):
+    buffer = b''
+    started = False
+    while True:
+        chunk = file.read(chunk_bytes)
+        buffer += chunk
+        if not started:
+            stripped = buffer.lstrip(b'\xef\xbb\xbf \t\r\n')
+            if not stripped and chunk:
+                continue
+            if not stripped.startswith(b'['):
+                raise ValueError("A collection dump must be a top-level JSON array")
+            buffer = stripped[1:]
+            started = True
+
+        starts, ends, array_end = element_bounds(buffer)
+        if len(ends):
+            yield b'[' + buffer[starts[0]:ends[-1] + 1] + b']'
+
+        if array_end is not None:
+            break
+        if not chunk:
+            raise ValueError("Truncated JSON array: the dump ended inside the array")
+        buffer = buffer[ends[-1] + 1:] if len(ends) else buffer
+
+
+# The documents of a JSON dump (a binary file) parsed chunk by chunk
+# (iter_json_chunks), in lists of at most batch_size documents
+def iter_json_batches(file, batch_size, backend=JSON_BACKEND, chunk_bytes=READ_CHUNK_BYTES):
+    pending = []
+    for chunk in iter_json_chunks(file, chunk_bytes):
+        pending.extend(parse_json(chunk, backend))
+        while len(pending) >= batch_size:
+            yield pending[:batch_size]
+            pending = pending[batch_size:]
+    if pending:
+        yield pending
+
+
+# Documents of a JSON dump one by one, read batch by batch
+def iter_json_documents(file, batch_size=1000, backend=JSON_BACKEND, chunk_bytes=READ_CHUNK_BYTES):
+    for batch in iter_json_batches(file, batch_size, backend, chunk_bytes):
+        yield from batch
@@ -0,0 +1,163 @@
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from psycopg2 import sql
+from db_pool import pooled_connection
+from id_storage import binary_columns, from_storage_id
+from instrumentation import step
+
+# Keys held exactly per cache (about 150 bytes each); beyond that the least
+# recently used are evicted and only the Bloom filter remembers them
+KEY_CACHE_CAPACITY = 500000
+
+# False positive rate of the Bloom filters at their designed key count
+BLOOM_FALSE_POSITIVE_RATE = 0.01
+
+_key_cache_capacity = KEY_CACHE_CAPACITY
+
+_MISSING = object()
+
+
+def set_key_cache_capacity(capacity=KEY_CACHE_CAPACITY):
+    global _key_cache_capacity
+    _key_cache_capacity = capacity
+
+
+# Bit-packed Bloom filter over string keys. The k bit positions of a key are
+# derived from two 64-bit pandas hashes (double hashing), vectorised over a
+# whole batch of keys. Keys cannot be removed; a key it rules out was never
+# added.
+class BloomFilter:
+    def __init__(self, expected_keys, false_positive_rate=BLOOM_FALSE_POSITIVE_RATE):
+        expected_keys = max(expected_keys, 1)
+        self.size = max(64, int(-expected_keys * np.log(false_positive_rate) / np.log(2) ** 2))
+        self.hashes = max(1, round(self.size / expected_keys * np.log(2)))
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, keys):
+        keys = np.asarray(keys, dtype=object)
+        first = pd.util.hash_array(keys)
+        second = pd.util.hash_array(keys, hash_key='markt-pilot-keys') | np.uint64(1)
+        steps = np.arange(self.hashes, dtype=np.uint64)
+        return (first[:, None] + steps * second[:, None]) % np.uint64(self.size)
+
+    def add(self, keys):
+        positions = self._positions(keys).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3), (np.uint64(1) << (positions & np.uint64(7))).astype(np.uint8))
+
+    def might_contain(self, keys):
+        positions = self._positions(keys)
+        return ((self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7))) & 1).all(axis=1)
+
+
+# Bounded cache of the keys of a PostgreSQL table (and optionally one value
+# per key, e.g. the run date), so referential checks of a batch never query
+# the database per row. warm() reads the table with one query; add() and
+# discard() keep the cache current as batches are loaded and deleted.
+# Up to the capacity the keys are held exactly, least recently used evicted
+# first. Every key ever added also goes into a Bloom filter: a key it rules
+# out is unknown for sure, and the few evicted candidates it cannot rule out
+# are confirmed with one query per lookup. As long as nothing was evicted
+# the cache is exact and lookups never touch the database. Thread-safe, so
+# the clean and load stages of the pipeline can share it.
+class KeyCache:
+    def __init__(self, table, key_column, value_column=None, dtype=None, capacity=None):
+        self.table = table
+        self.key_column = key_column
+        self.value_column = value_column
+        self.dtype = dtype if value_column else bool
+        self.capacity = capacity or _key_cache_capacity
+        self.entries = OrderedDict()
+        self.bloom = BloomFilter(self.capacity)
+        self.evicted = False
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def _select(self):
+        columns = [self.key_column] + ([self.value_column] if self.value_column else [])
+        return sql.SQL("SELECT {} FROM public.{}").format(
+            sql.SQL(', ').join(map(sql.Identifier, columns)), sql.Identifier(self.table)
+        )
+
+    def _rows(self, rows):
+        keys = [from_storage_id(row[0]) for row in rows]
+        values = [row[1] for row in rows] if self.value_column else None
+        return keys, values
+
+    # Load every key of the table with a single query
+    def warm(self, cursor):
+        with step(f'key_cache.warm.{self.table}') as record:
+            cursor.execute(self._select())
+            keys, values = self._rows(cursor.fetchall())
+            with self.lock:
+                self.entries.clear()
+                self.evicted = False
+                # Room for the table to double before the false positive rate degrades
+                self.bloom = BloomFilter(max(self.capacity, 2 * len(keys)))
+                self._add(keys, values)
+            record['rows_out'] = len(keys)
+        print(f"{self.table}: {len(keys)} keys cached")
+
+    def _add(self, keys, values):
+        if not len(keys):
+            return
+        self.bloom.add(keys)
+        for key, value in zip(keys, values if values is not None else [True] * len(keys)):
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+            self.evicted = True
+
+    # Record loaded keys (and their values)
+    def add(self, keys, values=None):
+        keys = list(keys)
+        with self.lock:
+            self._add(keys, None if values is None else list(values))
+
+    # Forget deleted keys; the Bloom filter keeps them, so an evicting cache
+    # confirms them against the database before trusting them again
+    def discard(self, keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    # The distinct known keys among `keys`, as a Series of their values
+    # indexed by key (True for a cache without values). Missing ids are ignored.
+    def lookup(self, keys):
+        keys = pd.unique(np.asarray(keys, dtype=object))
+        found = {}
+        missing = []
+        with self.lock:
+            for key in keys:
+                if pd.isna(key):
+                    continue
+                value = self.entries.get(key, _MISSING)
+                if value is _MISSING:
+                    missing.append(key)
+                else:
+                    self.entries.move_to_end(key)
+                    found[key] = value
+            candidates = [key for key, maybe in zip(missing, self.bloom.might_contain(missing)) if maybe] \
+                if missing and self.evicted else []
+        if candidates:
+            confirmed_keys, confirmed_values = self._confirm(candidates)
+            self.add(confirmed_keys, confirmed_values)
+            found.update(zip(confirmed_keys, confirmed_values or [True] * len(confirmed_keys)))
+        return pd.Series(list(found.values()), index=pd.Index(list(found), dtype=object), dtype=self.dtype)
+
+    # One query for all the candidate keys of a lookup
+    def _confirm(self, keys):
+        with step(f'key_cache.confirm.{self.table}', rows_in=len(keys)) as record:
+            with pooled_connection() as conn, conn.cursor() as cursor:
+                binary = self.key_column in binary_columns(cursor, self.table)
+                cursor.execute(
+                    self._select() + sql.SQL(" WHERE {} = ANY(%s)").format(sql.Identifier(self.key_column)),
+                    [[bytes.fromhex(key) for key in keys] if binary else list(keys)]
+                )
+                keys, values = self._rows(cursor.fetchall())
+            record['rows_out'] = len(keys)
+        return keys, values
@@ -0,0 +1,78 @@
+import numpy as np
+import pandas as pd
+import bson
+from concurrent.futures import ProcessPoolExecutor
+from data_quality import drop_duplicates_keep_smallest, filter_references
+from field_mappings import COLLECTION_MAPPINGS
+from flatten import flatten_collection
+from id_codes import NULL_CODE
+from json_stream import parse_json
+
+# Default number of transform processes; 1 keeps the transform in-process
+TRANSFORM_WORKERS = 1
+
+# Valid keys of the current run per referenced collection, as a pd.Index of
+# hex ids and the parent's int32 code of each, handed to each worker process
+# once by init_worker instead of being pickled with every chunk
+_valid_keys = None
+
+
+def init_worker(valid_keys):
+    global _valid_keys
+    _valid_keys = {collection_name: (pd.Index(ids, dtype=object), np.asarray(codes, dtype=np.int32))
+                   for collection_name, (ids, codes) in valid_keys.items()}
+
+
+# Documents of a raw chunk of a source (Source.raw_format)
+def parse_documents(data, raw_format):
+    if raw_format == 'bson':
+        return bson.decode_all(data)
+    return parse_json(data)
+
+
+# Worker task: parse, flatten and clean one raw chunk of sonar_results with
+# the references and dedup rules of its mapping. The referenced id columns
+# are encoded into the parent's code spaces with one get_indexer per column,
+# which also tells the unknown ids apart. Duplicates within the chunk are
+# dropped already (the smallest sonar_result_id per pair survives the merge
+# as well). Returns the kept rows, ready for the parent, the rejected rows
+# with hex ids, and the number of documents in the chunk.
+def transform_chunk(data, raw_format):
+    mapping = COLLECTION_MAPPINGS['sonar_results']
+    sonar_results_df = flatten_collection('sonar_results', parse_documents(data, raw_format))
+
+    encoded, checks = {}, []
+    for column, (collection_name, reason) in mapping['references'].items():
+        ids, codes = _valid_keys[collection_name]
+        positions = ids.get_indexer(sonar_results_df[column].to_numpy(dtype=object))
+        encoded[column] = np.where(positions >= 0, codes[positions], NULL_CODE).astype(np.int32)
+        checks.append((column, codes, reason))
+    kept_df, rejected_df = filter_references(sonar_results_df.assign(**encoded), checks)
+    rejected_df = sonar_results_df.loc[rejected_df.index].assign(rejected_reason=rejected_df['rejected_reason'])
+
+    kept_df = drop_duplicates_keep_smallest(kept_df, mapping['dedup'], mapping['key'])
+    return kept_df, rejected_df, len(sonar_results_df)
+
+
+# Transform and clean the raw chunks of sonar_results in a pool of `workers`
+# processes. The parent only hands the unparsed chunks on; parsing, flatten,
+# the referential check and the encoding happen in the workers. valid_keys
+# maps each referenced collection to its valid hex ids and their codes in
+# the parent's IdEncoder and is sent to every worker once. The chunks are
+# merged back in input order and deduplicated across chunks, so the result
+# matches the single-process clean: kept rows with int32 codes in the
+# referenced id columns, rejected rows with hex ids, and the document count.
+def transform_sonar_results_parallel(chunks, raw_format, valid_keys, workers):
+    mapping = COLLECTION_MAPPINGS['sonar_results']
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(valid_keys,)) as executor:
+        results = list(executor.map(transform_chunk, chunks, [raw_format] * len(chunks)))
+    if not results:
+        # Same columns and code dtypes as chunks without a single row
+        empty = flatten_collection('sonar_results', [])
+        kept_df = empty.astype({column: np.int32 for column in mapping['references']})
+        return kept_df, empty.assign(rejected_reason=pd.Series(dtype=object)), 0
+
+    sonar_results_df = pd.concat([df for df, _, _ in results], ignore_index=True)
+    sonar_results_df = drop_duplicates_keep_smallest(sonar_results_df, mapping['dedup'], mapping['key']).reset_index(drop=True)
+    rejected_df = pd.concat([df for _, df, _ in results], ignore_index=True)
+    return sonar_results_df, rejected_df, sum(rows for _, _, rows in results)
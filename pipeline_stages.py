@@ -0,0 +1,172 @@
+import time
+import queue
+import threading
+from instrumentation import record_pipeline, step
+
+# Batches buffered between two stages before the upstream stage blocks
+STAGE_QUEUE_SIZE = 4
+
+# Put on a stage queue after the last batch
+_END = object()
+
+
+# Counters of one stage, updated only by the stage's own thread
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.batches = 0
+        self.rows_in = 0
+        self.rows_out = 0
+        self.busy_seconds = 0.0
+        self.starved_seconds = 0.0  # waiting for input from the upstream stage
+        self.blocked_seconds = 0.0  # waiting for room in the downstream queue (backpressure)
+        self.depth_total = 0
+        self.depth_max = 0
+
+    def sample_depth(self, depth):
+        self.depth_total += depth
+        self.depth_max = max(self.depth_max, depth)
+
+    def as_dict(self, elapsed):
+        return {
+            "stage": self.name,
+            "batches": self.batches,
+            "rows_in": self.rows_in,
+            "rows_out": self.rows_out,
+            "busy_seconds": self.busy_seconds,
+            "starved_seconds": self.starved_seconds,
+            "blocked_seconds": self.blocked_seconds,
+            "rows_per_sec": self.rows_in / self.busy_seconds if self.busy_seconds > 0 else float('inf'),
+            "utilisation": self.busy_seconds / elapsed if elapsed > 0 else 0.0,
+            "avg_queue_depth": self.depth_total / self.batches if self.batches else 0.0,
+            "max_queue_depth": self.depth_max,
+        }
+
+
+# Runs a source and a chain of stages concurrently, one thread each, linked
+# by bounded queues. `source` is an iterable of batches; `stages` is a list of
+# (name, function) where function(batch) returns the batch for the next stage
+# (None passes nothing on). Rows are counted with len(batch). A failing stage
+# stops the whole pipeline and its exception is re-raised by run().
+class Pipeline:
+    def __init__(self, source_name, source, stages, queue_size=STAGE_QUEUE_SIZE):
+        self.source = source
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+        self.stats = [StageStats(source_name)] + [StageStats(name) for name, _ in stages]
+        self.stopped = threading.Event()
+        self.error = None
+        self.elapsed = 0.0
+
+    def run(self):
+        start = time.perf_counter()
+        threads = [threading.Thread(target=self._run_source, name=self.stats[0].name)]
+        threads += [threading.Thread(target=self._run_stage, args=(index,), name=name)
+                    for index, (name, _) in enumerate(self.stages)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.elapsed = time.perf_counter() - start
+
+        if self.error is not None:
+            raise self.error
+        self.report()
+        stage_stats = [stats.as_dict(self.elapsed) for stats in self.stats]
+        record_pipeline(stage_stats)
+        return stage_stats
+
+    def _fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.stopped.set()
+
+    # Blocking put that gives up once the pipeline is stopped
+    def _put(self, stage_queue, item, stats):
+        start = time.perf_counter()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    stage_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        finally:
+            stats.blocked_seconds += time.perf_counter() - start
+
+    # Blocking get that returns _END once the pipeline is stopped
+    def _get(self, stage_queue, stats):
+        stats.sample_depth(stage_queue.qsize())
+        start = time.perf_counter()
+        try:
+            while not self.stopped.is_set():
+                try:
+                    return stage_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return _END
+        finally:
+            stats.starved_seconds += time.perf_counter() - start
+
+    def _run_source(self):
+        stats = self.stats[0]
+        out_queue = self.queues[0] if self.queues else None
+        try:
+            batches = iter(self.source)
+            while True:
+                start = time.perf_counter()
+                batch = next(batches, _END)
+                stats.busy_seconds += time.perf_counter() - start
+                if batch is _END:
+                    break
+                stats.batches += 1
+                stats.rows_in += len(batch)
+                stats.rows_out += len(batch)
+                if out_queue is not None and not self._put(out_queue, batch, stats):
+                    return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            if out_queue is not None:
+                self._put(out_queue, _END, stats)
+
+    def _run_stage(self, index):
+        _, function = self.stages[index]
+        stats = self.stats[index + 1]
+        in_queue = self.queues[index]
+        out_queue = self.queues[index + 1] if index + 1 < len(self.queues) else None
+        try:
+            while True:
+                batch = self._get(in_queue, stats)
+                if batch is _END:
+                    break
+                start = time.perf_counter()
+                with step(f'stage.{stats.name}', rows_in=len(batch)) as record:
+                    result = function(batch)
+                    record['rows_out'] = len(result) if result is not None else 0
+                stats.busy_seconds += time.perf_counter() - start
+                stats.batches += 1
+                stats.rows_in += len(batch)
+                stats.rows_out += len(result) if result is not None else 0
+                if out_queue is not None and result is not None and not self._put(out_queue, result, stats):
+                    return
+        except Exception as e:
+            self._fail(e)
+        finally:
+            if out_queue is not None:
+                self._put(out_queue, _END, stats)
+
+    # Per-stage throughput and queue depth; the busiest stage is the bottleneck
+    def report(self):
+        print(f"Pipeline finished in {self.elapsed:.2f}s")
+        print(f"{'stage':<12}{'batches':>9}{'rows in':>11}{'rows out':>11}{'busy':>9}{'rows/sec':>11}"
+              f"{'util':>7}{'starved':>9}{'blocked':>9}{'avg q':>7}{'max q':>7}")
+        stage_stats = [stats.as_dict(self.elapsed) for stats in self.stats]
+        for stats in stage_stats:
+            print(f"{stats['stage']:<12}{stats['batches']:>9}{stats['rows_in']:>11}{stats['rows_out']:>11}"
+                  f"{stats['busy_seconds']:>8.2f}s{stats['rows_per_sec']:>11.0f}{stats['utilisation']:>7.0%}"
+                  f"{stats['starved_seconds']:>8.2f}s{stats['blocked_seconds']:>8.2f}s"
+                  f"{stats['avg_queue_depth']:>7.1f}{stats['max_queue_depth']:>7}")
+        bottleneck = max(stage_stats, key=lambda stats: stats['utilisation'])
+        print(f"Bottleneck stage: {bottleneck['stage']}")
@@ -0,0 +1,74 @@
+import pandas as pd
+from psycopg2 import sql
+from db_pool import pooled_connection
+from id_storage import id_column_type
+
+# Denormalised price history: one row per sonar result with the date of its
+# run, so price-over-time queries are range scans instead of joins through
+# sonar_runs. Range-partitioned by year of the run date; the BRIN index on
+# run_date stays tiny because rows are loaded in run_date order.
+PRICE_HISTORY_TABLE = """
+CREATE TABLE IF NOT EXISTS public.price_history (
+    run_date DATE NOT NULL,
+    sonar_result_id {id_type} NOT NULL,
+    part_id {id_type},
+    supplier_id {id_type},
+    price_norm float8,
+    CONSTRAINT price_history_pk PRIMARY KEY (run_date, sonar_result_id)
+) PARTITION BY RANGE (run_date);
+CREATE INDEX IF NOT EXISTS price_history_run_date_brin ON public.price_history USING brin (run_date);
+"""
+
+
+def create_price_history_table(cursor):
+    cursor.execute(PRICE_HISTORY_TABLE.format(id_type=id_column_type()))
+
+
+# Run date per sonar_run_id, from a sonar_runs frame with the target columns
+def run_dates(sonar_runs_frame):
+    return pd.Series(sonar_runs_frame['date'].to_numpy(), index=sonar_runs_frame['sonar_run_id'].to_numpy())
+
+
+# One yearly partition per year in `dates` (strings 'YYYY-MM-DD'); run once
+# per load, before the chunks are loaded concurrently
+def create_price_history_partitions(dates):
+    years = sorted({int(date[:4]) for date in pd.unique(dates)})
+    if not years:
+        return
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        for year in years:
+            cursor.execute(sql.SQL(
+                "CREATE TABLE IF NOT EXISTS public.{} PARTITION OF public.price_history "
+                "FOR VALUES FROM ({}) TO ({})"
+            ).format(sql.Identifier(f'price_history_{year}'),
+                     sql.Literal(f'{year}-01-01'), sql.Literal(f'{year + 1}-01-01')))
+
+
+# Run date of each of the sonar_run_ids (a Series), missing where unknown.
+# Reindexed rather than mapped: Series.map fails on an empty datetime Series,
+# which a batch without any known run hands in.
+def map_run_dates(sonar_run_ids, dates):
+    return pd.Series(dates.reindex(sonar_run_ids.to_numpy()).to_numpy(), index=sonar_run_ids.index)
+
+
+# {'price_history': frame} for a sonar_results frame with the target columns,
+# built in memory from the results and the run dates. Results whose run date
+# is unknown are left out. The yearly partitions are created here.
+def price_history_frames(sonar_results_frame, dates):
+    run_date = map_run_dates(sonar_results_frame['sonar_run_id'], dates)
+    known = run_date.notna()
+    frame = pd.DataFrame({
+        'run_date': pd.to_datetime(run_date[known]).dt.strftime('%Y-%m-%d'),
+        'sonar_result_id': sonar_results_frame['sonar_result_id'][known],
+        'part_id': sonar_results_frame['part_id'][known],
+        'supplier_id': sonar_results_frame['supplier_id'][known],
+        'price_norm': pd.to_numeric(sonar_results_frame['price_norm'][known], errors='coerce').astype('float64'),
+    })
+    if frame.empty:
+        return {}
+    try:
+        create_price_history_partitions(frame['run_date'])
+    except Exception as e:
+        print(f"Error creating price_history partitions: {e}")
+        return {}
+    return {'price_history': frame}
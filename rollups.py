@@ -0,0 +1,147 @@
+from contextlib import ExitStack
+import pandas as pd
+from bulk_load import staging_table
+from db_pool import pooled_connection
+from id_storage import id_column_type
+from instrumentation import step
+
+# Aggregate tables behind the dashboards: results per part, supplier and
+# country, and daily price statistics per part (day of the sonar run)
+ROLLUP_TABLES = """
+CREATE TABLE IF NOT EXISTS public.part_result_counts (
+    part_id {id_type} PRIMARY KEY,
+    results BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS public.supplier_result_counts (
+    supplier_id {id_type} PRIMARY KEY,
+    results BIGINT NOT NULL,
+    -- Country the supplier was counted under, so a supplier moving to
+    -- another country also refreshes the one it left
+    country VARCHAR
+);
+CREATE TABLE IF NOT EXISTS public.country_result_counts (
+    country VARCHAR PRIMARY KEY,
+    results BIGINT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS public.part_daily_prices (
+    part_id {id_type},
+    day DATE,
+    min_price numeric,
+    max_price numeric,
+    avg_price numeric,
+    results BIGINT NOT NULL,
+    CONSTRAINT part_daily_prices_pk PRIMARY KEY (part_id, day)
+);
+"""
+
+# Suppliers without a country are counted under this key
+UNKNOWN_COUNTRY = 'unknown'
+
+# Incremental refresh for the runs in the temp table touched_runs and the
+# keys in given_parts, given_suppliers and given_countries. Every part,
+# supplier, country and (part, day) a touched run contributes to is
+# recomputed from the base tables, and so is every given key, with all the
+# days of a given part; all other rollup rows stay as they are. The given
+# keys cover what the runs no longer lead to: parts and suppliers of deleted
+# results, suppliers whose country changed.
+REFRESH_STATEMENTS = [
+    # Keys affected by the touched runs, plus the given ones
+    """CREATE TEMP TABLE touched_parts ON COMMIT DROP AS
+       SELECT r.part_id FROM public.sonar_results r
+       JOIN touched_runs t ON t.sonar_run_id = r.sonar_run_id
+       WHERE r.part_id IS NOT NULL
+       UNION SELECT part_id FROM given_parts WHERE part_id IS NOT NULL""",
+    """CREATE TEMP TABLE touched_suppliers ON COMMIT DROP AS
+       SELECT r.supplier_id FROM public.sonar_results r
+       JOIN touched_runs t ON t.sonar_run_id = r.sonar_run_id
+       WHERE r.supplier_id IS NOT NULL
+       UNION SELECT supplier_id FROM given_suppliers WHERE supplier_id IS NOT NULL""",
+    # Current country of each touched supplier and the one it was counted under
+    """CREATE TEMP TABLE touched_countries ON COMMIT DROP AS
+       SELECT COALESCE(s.country, %(unknown)s) AS country FROM public.suppliers_table s
+       JOIN touched_suppliers t ON t.supplier_id = s.supplier_id
+       UNION SELECT c.country FROM public.supplier_result_counts c
+       JOIN touched_suppliers t ON t.supplier_id = c.supplier_id
+       WHERE c.country IS NOT NULL
+       UNION SELECT COALESCE(country, %(unknown)s) FROM given_countries""",
+    """CREATE TEMP TABLE touched_part_days ON COMMIT DROP AS
+       SELECT r.part_id, sr.date::date AS day FROM public.sonar_results r
+       JOIN touched_runs t ON t.sonar_run_id = r.sonar_run_id
+       JOIN public.sonar_runs sr ON sr.sonar_run_id = r.sonar_run_id
+       WHERE r.part_id IS NOT NULL AND sr.date IS NOT NULL
+       UNION SELECT p.part_id, p.day FROM public.part_daily_prices p
+       JOIN given_parts g ON g.part_id = p.part_id""",
+
+    # Results per part
+    """DELETE FROM public.part_result_counts p USING touched_parts t WHERE p.part_id = t.part_id""",
+    """INSERT INTO public.part_result_counts (part_id, results)
+       SELECT r.part_id, count(*) FROM public.sonar_results r
+       JOIN touched_parts t ON t.part_id = r.part_id
+       GROUP BY r.part_id""",
+
+    # Results per supplier
+    """DELETE FROM public.supplier_result_counts c USING touched_suppliers t WHERE c.supplier_id = t.supplier_id""",
+    """INSERT INTO public.supplier_result_counts (supplier_id, results, country)
+       SELECT r.supplier_id, count(*), COALESCE(min(s.country), %(unknown)s) FROM public.sonar_results r
+       JOIN touched_suppliers t ON t.supplier_id = r.supplier_id
+       LEFT JOIN public.suppliers_table s ON s.supplier_id = r.supplier_id
+       GROUP BY r.supplier_id""",
+
+    # Results per country, summed from the (small) supplier rollup
+    """DELETE FROM public.country_result_counts c USING touched_countries t WHERE c.country = t.country""",
+    """INSERT INTO public.country_result_counts (country, results)
+       SELECT COALESCE(s.country, %(unknown)s), sum(c.results) FROM public.supplier_result_counts c
+       JOIN public.suppliers_table s ON s.supplier_id = c.supplier_id
+       WHERE COALESCE(s.country, %(unknown)s) IN (SELECT country FROM touched_countries)
+       GROUP BY 1""",
+
+    # Daily price statistics per part
+    """DELETE FROM public.part_daily_prices p USING touched_part_days t
+       WHERE p.part_id = t.part_id AND p.day = t.day""",
+    """INSERT INTO public.part_daily_prices (part_id, day, min_price, max_price, avg_price, results)
+       SELECT r.part_id, sr.date::date, min(r.price_norm), max(r.price_norm), avg(r.price_norm), count(*)
+       FROM public.sonar_results r
+       JOIN public.sonar_runs sr ON sr.sonar_run_id = r.sonar_run_id
+       JOIN touched_part_days t ON t.part_id = r.part_id AND t.day = sr.date::date
+       GROUP BY r.part_id, sr.date::date""",
+]
+
+
+def create_rollup_tables(cursor):
+    cursor.execute(ROLLUP_TABLES.format(id_type=id_column_type()))
+
+
+# Distinct non-missing values of `values` as a one-column DataFrame
+def distinct_keys(column, values):
+    return pd.DataFrame({column: pd.Series(values, dtype=object).dropna().unique()})
+
+
+# Refresh the rollups for the given sonar run ids (the runs and results of
+# the current load) and the part ids, supplier ids and countries given
+# directly, in one transaction, so readers never see a half-refreshed key.
+# Returns whether the refresh succeeded (or had nothing to do).
+def refresh_rollups(sonar_run_ids, part_ids=(), supplier_ids=(), countries=()):
+    touched_runs = distinct_keys('sonar_run_id', sonar_run_ids)
+    given = [
+        ('given_parts', 'sonar_results', distinct_keys('part_id', part_ids)),
+        ('given_suppliers', 'suppliers_table', distinct_keys('supplier_id', supplier_ids)),
+        ('given_countries', 'suppliers_table', distinct_keys('country', countries)),
+    ]
+    if touched_runs.empty and all(keys.empty for _, _, keys in given):
+        return True
+    try:
+        with step('rollups.refresh', rows_in=len(touched_runs) + sum(len(keys) for _, _, keys in given)):
+            with pooled_connection() as conn, conn.cursor() as cursor, ExitStack() as staged:
+                # Each key set is a temp table typed like the column it comes from
+                staged.enter_context(staging_table(cursor, 'touched_runs', 'sonar_runs', ['sonar_run_id'], touched_runs))
+                cursor.execute("ALTER TABLE touched_runs ADD PRIMARY KEY (sonar_run_id)")
+                for name, table, keys in given:
+                    staged.enter_context(staging_table(cursor, name, table, list(keys.columns), keys))
+                for statement in REFRESH_STATEMENTS:
+                    cursor.execute(statement, {'unknown': UNKNOWN_COUNTRY})
+        print(f"Rollups refreshed for {len(touched_runs)} sonar runs and "
+              f"{sum(len(keys) for _, _, keys in given)} given keys")
+        return True
+    except Exception as e:
+        print(f"Error refreshing rollups: {e}")
+        return False
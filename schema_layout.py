@@ -0,0 +1,144 @@
+import time
+from psycopg2 import sql
+from db_pool import pooled_connection
+from id_storage import id_column_type
+from instrumentation import step
+
+# Secondary indexes on the join and filter keys, as (name, table, columns).
+# create_tables leaves them out; they are built once the bulk load is done,
+# which is much cheaper than maintaining them row by row during the load.
+SECONDARY_INDEXES = [
+    ('sonar_results_sonar_run_id_idx', 'sonar_results', ['sonar_run_id']),
+    ('sonar_results_supplier_id_idx', 'sonar_results', ['supplier_id']),
+    ('sonar_results_part_id_idx', 'sonar_results', ['part_id']),
+    ('sonar_runs_date_idx', 'sonar_runs', ['date']),
+    ('sonar_runs_client_id_idx', 'sonar_runs', ['client_id']),
+    # The unique (sonar_run_id, supplier_id) constraint covers lookups by run
+    ('sonar_run_suppliers_supplier_id_idx', 'sonar_run_suppliers', ['supplier_id']),
+    # Price evolution of one part; the time range is covered by the BRIN index
+    ('price_history_part_id_idx', 'price_history', ['part_id']),
+]
+
+# Number of hash partitions of sonar_results by part_id; 0 keeps a plain table
+SONAR_RESULTS_PARTITIONS = 0
+
+_partitions = SONAR_RESULTS_PARTITIONS
+
+
+# Partitioning only applies to a sonar_results table that does not exist yet.
+# The primary key of a partitioned table must contain the partition key, so
+# it is (sonar_result_id, part_id); the loads read the key of the table that
+# exists (bulk_load.conflict_columns), not this setting.
+def set_sonar_results_partitions(partitions=SONAR_RESULTS_PARTITIONS):
+    global _partitions
+    _partitions = partitions
+
+
+def sonar_results_partitions():
+    return _partitions
+
+
+# sonar_results hash-partitioned by part_id into sonar_results_p0 ... pN-1.
+# Foreign keys on a partitioned table cannot be NOT VALID, so they are
+# enforced; clean_data already drops rows with unknown runs or suppliers.
+def create_partitioned_sonar_results(cursor, partitions=None):
+    partitions = partitions or _partitions
+    id_type = id_column_type()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS public.sonar_results(
+        sonar_result_id {id_type},
+        sonar_run_id {id_type},
+        supplier_id {id_type},
+        price_norm numeric,
+        part_id {id_type} NOT NULL,
+        CONSTRAINT sonar_results_pk PRIMARY KEY (sonar_result_id, part_id),
+        CONSTRAINT sonar_i_fk FOREIGN KEY (sonar_run_id)
+        REFERENCES public.sonar_runs (sonar_run_id) MATCH SIMPLE,
+        CONSTRAINT supply_id_fkey FOREIGN KEY (supplier_id)
+        REFERENCES public.suppliers_table (supplier_id) MATCH SIMPLE
+    ) PARTITION BY HASH (part_id);
+    """)
+    for remainder in range(partitions):
+        cursor.execute(sql.SQL(
+            "CREATE TABLE IF NOT EXISTS public.{} PARTITION OF public.sonar_results "
+            "FOR VALUES WITH (MODULUS {}, REMAINDER {})"
+        ).format(sql.Identifier(f'sonar_results_p{remainder}'), sql.Literal(partitions), sql.Literal(remainder)))
+
+    # An existing plain table is kept as it is
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = 'public.sonar_results'::regclass")
+    if cursor.fetchone()[0] != 'p':
+        print("sonar_results already exists as a plain table and is loaded as such; drop it to switch to hash partitioning.")
+
+
+# Build the missing secondary indexes and refresh the planner statistics.
+# Indexes on a partitioned sonar_results are created on every partition.
+def create_indexes():
+    try:
+        with pooled_connection(autocommit=True) as conn, conn.cursor() as cursor:
+            for name, table, columns in SECONDARY_INDEXES:
+                with step(f'indexes.{name}'):
+                    cursor.execute(sql.SQL("CREATE INDEX IF NOT EXISTS {} ON public.{} ({})").format(
+                        sql.Identifier(name), sql.Identifier(table), sql.SQL(', ').join(map(sql.Identifier, columns))
+                    ))
+            for table in sorted({table for _, table, _ in SECONDARY_INDEXES}):
+                cursor.execute(sql.SQL("ANALYZE public.{}").format(sql.Identifier(table)))
+        print("Secondary indexes built.")
+    except Exception as e:
+        print(f"Error creating indexes: {e}")
+
+
+# Drop the secondary indexes, e.g. before a large reload or to time queries without them
+def drop_indexes():
+    try:
+        with pooled_connection(autocommit=True) as conn, conn.cursor() as cursor:
+            for name, _, _ in SECONDARY_INDEXES:
+                cursor.execute(sql.SQL("DROP INDEX IF EXISTS public.{}").format(sql.Identifier(name)))
+        print("Secondary indexes dropped.")
+    except Exception as e:
+        print(f"Error dropping indexes: {e}")
+
+
+# Typical loader and analytical queries, timed with and without the indexes
+BENCHMARK_QUERIES = {
+    'results_of_run': """
+        SELECT count(*), avg(price_norm) FROM public.sonar_results
+        WHERE sonar_run_id = (SELECT max(sonar_run_id) FROM public.sonar_runs)""",
+    'results_of_supplier': """
+        SELECT count(*), avg(price_norm) FROM public.sonar_results
+        WHERE supplier_id = (SELECT max(supplier_id) FROM public.suppliers_table)""",
+    'part_price_history': """
+        SELECT sr.date, min(r.price_norm), max(r.price_norm) FROM public.sonar_results r
+        JOIN public.sonar_runs sr ON sr.sonar_run_id = r.sonar_run_id
+        WHERE r.part_id = (SELECT part_id FROM public.sonar_results LIMIT 1)
+        GROUP BY sr.date""",
+    'runs_of_month': """
+        SELECT count(*) FROM public.sonar_runs
+        WHERE date >= (SELECT date_trunc('month', max(date)) FROM public.sonar_runs)""",
+    'part_price_history_fact': """
+        SELECT run_date, min(price_norm), max(price_norm) FROM public.price_history
+        WHERE part_id = (SELECT part_id FROM public.price_history LIMIT 1)
+        GROUP BY run_date""",
+    'prices_of_recent_year': """
+        SELECT count(*), avg(price_norm) FROM public.price_history
+        WHERE run_date >= (SELECT max(run_date) - 365 FROM public.price_history)""",
+    'results_of_recent_runs': """
+        SELECT count(*) FROM public.sonar_results r
+        JOIN public.sonar_runs sr ON sr.sonar_run_id = r.sonar_run_id
+        WHERE sr.date >= (SELECT date_trunc('month', max(date)) FROM public.sonar_runs)""",
+}
+
+
+# Best of `repeats` wall times per query, in seconds
+def time_queries(queries=None, repeats=5):
+    timings = {}
+    with pooled_connection() as conn, conn.cursor() as cursor:
+        for name, query in (queries or BENCHMARK_QUERIES).items():
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                cursor.execute(query)
+                cursor.fetchall()
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            timings[name] = best
+    return timings
@@ -0,0 +1,92 @@
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet snapshots are optional
+    pa = None
+    pq = None
+
+# Folder holding one Parquet file per collection
+SNAPSHOT_PATH = os.path.join('collections', 'snapshot')
+
+# Rows per Parquet row group
+ROW_GROUP_SIZE = 100000
+
+
+def require_pyarrow():
+    if pa is None:
+        raise RuntimeError("Parquet snapshots need pyarrow: pip install pyarrow")
+
+
+def snapshot_file(collection_name, snapshot_path=SNAPSHOT_PATH):
+    return os.path.join(snapshot_path, f'{collection_name}.parquet')
+
+
+def snapshot_exists(collection_names, snapshot_path=SNAPSHOT_PATH):
+    return all(os.path.exists(snapshot_file(name, snapshot_path)) for name in collection_names)
+
+
+# Write an iterable of normalized DataFrames (e.g. extract batches) to one
+# Parquet file, each frame as its own row group(s). The schema of the first
+# frame is kept; later frames are cast to it. Without any frame the file gets
+# the schema of `empty` (an empty frame of the columns), so an empty
+# collection still has its snapshot. The file is written under a temporary
+# name and only moved into place once every frame is in, so a failing
+# origin never leaves a truncated snapshot behind.
+def write_snapshot(collection_name, frames, snapshot_path=SNAPSHOT_PATH, empty=None):
+    require_pyarrow()
+    os.makedirs(snapshot_path, exist_ok=True)
+    file_path = snapshot_file(collection_name, snapshot_path)
+    temp_path = f"{file_path}.tmp"
+
+    writer = None
+    rows = 0
+    try:
+        for df in frames:
+            table = pa.Table.from_pandas(df, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(temp_path, table.schema)
+            else:
+                for field in writer.schema:
+                    if field.name not in table.column_names:
+                        table = table.append_column(field.name, pa.nulls(len(table), field.type))
+                table = table.select(writer.schema.names).cast(writer.schema)
+            writer.write_table(table, row_group_size=ROW_GROUP_SIZE)
+            rows += len(df)
+        if writer is None:
+            if empty is None:
+                return 0
+            writer = pq.ParquetWriter(temp_path, pa.Table.from_pandas(empty, preserve_index=False).schema)
+        writer.close()
+        writer = None
+        os.replace(temp_path, file_path)
+    finally:
+        if writer is not None:
+            writer.close()
+            os.remove(temp_path)
+
+    print(f"Snapshot of {collection_name} written to {file_path} ({rows} rows)")
+    return rows
+
+
+# Read only the requested columns of a collection snapshot, memory-mapped
+def read_snapshot(collection_name, columns=None, snapshot_path=SNAPSHOT_PATH):
+    require_pyarrow()
+    file_path = snapshot_file(collection_name, snapshot_path)
+    if columns is not None:
+        available = set(pq.read_schema(file_path).names)
+        columns = [column for column in columns if column in available]
+    return pq.read_table(file_path, columns=columns, memory_map=True).to_pandas()
+
+
+# Read a collection snapshot as DataFrames of at most batch_size rows, so a
+# large snapshot is never held in memory as a whole
+def iter_snapshot(collection_name, columns=None, batch_size=ROW_GROUP_SIZE, snapshot_path=SNAPSHOT_PATH):
+    require_pyarrow()
+    parquet_file = pq.ParquetFile(snapshot_file(collection_name, snapshot_path), memory_map=True)
+    if columns is not None:
+        available = set(parquet_file.schema_arrow.names)
+        columns = [column for column in columns if column in available]
+    for record_batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+        yield record_batch.to_pandas()
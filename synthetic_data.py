@@ -0,0 +1,213 @@
+import os
+import json
+import argparse
+import numpy as np
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+
+# Synthetic clients, suppliers, sonar_runs and sonar_results in the document
+# shapes the pipeline reads, at any number of results. Documents are built
+# and written batch by batch, so the scale is bounded by disk, not memory.
+#   python synthetic_data.py 1000000 --form extended --output benchmark_data/synthetic
+#   python synthetic_data.py 1000000 --mongo-uri mongodb://localhost:27017/ --database Markt-Pilot
+
+# Default output folder, a scratch folder so the sample dumps in collections/ are never overwritten
+SYNTHETIC_PATH = os.path.join('benchmark_data', 'synthetic')
+
+# Documents generated and written per batch
+GENERATOR_BATCH_SIZE = 100000
+
+# Share of sonar_results pointing at an unknown run or supplier, so the
+# rejected-rows path is exercised as well
+UNKNOWN_REFERENCE_RATE = 0.02
+
+COUNTRIES = ['DEU', 'USA', 'GBR', 'CHE', 'AUT', 'FRA', 'ITA', 'NLD', 'POL', 'CHN']
+COUNTRY_WEIGHTS = [0.42, 0.26, 0.04, 0.04, 0.03, 0.05, 0.05, 0.04, 0.04, 0.03]
+RUN_STATUSES = ['complete', 'running', 'validating']
+RUN_STATUS_WEIGHTS = [0.98, 0.01, 0.01]
+FIRST_RUN_DATE = datetime(2020, 1, 1)
+
+
+# Entity counts derived from the number of sonar_results, close to the
+# proportions of the sample data
+def collection_sizes(results):
+    runs = max(10, results // 500)
+    return {
+        'clients': max(10, runs // 4),
+        'suppliers': int(min(max(100, results // 5), 50000)),
+        'sonar_runs': runs,
+        'parts': max(100, results // 6),
+        'sonar_results': results,
+    }
+
+
+# Deterministic ObjectIds: generation time plus a per-entity counter
+def object_ids(rng, count, start, end):
+    seconds = np.sort(rng.integers(int(start.timestamp()), int(end.timestamp()), count))
+    noise = rng.integers(0, 2 ** 40, count)
+    return [ObjectId(f"{second:08x}{random:010x}{counter % 2 ** 24:06x}")
+            for counter, (second, random) in enumerate(zip(seconds.tolist(), noise.tolist()))]
+
+
+def random_names(rng, count, length=8):
+    letters = rng.integers(ord('a'), ord('z') + 1, (count, length), dtype=np.uint8)
+    return [row.tobytes().decode('ascii') for row in letters]
+
+
+# Native documents (ObjectId / datetime values, as pymongo returns them), as
+# {collection_name: iterator of batches}. The small collections are one batch.
+def generate_collections(results, seed=0, batch_size=GENERATOR_BATCH_SIZE):
+    rng = np.random.default_rng(seed)
+    sizes = collection_sizes(results)
+    now = datetime(2024, 9, 1)
+
+    client_ids = object_ids(rng, sizes['clients'], FIRST_RUN_DATE - timedelta(days=365), now)
+    contract_months = rng.integers(0, 48, sizes['clients'])
+    clients = [
+        {'_id': client_id, 'name': name,
+         'contract_start': datetime(2019 + int(month) // 12, 1 + int(month) % 12, 1)}
+        for client_id, name, month in zip(client_ids, random_names(rng, sizes['clients']), contract_months)
+    ]
+
+    supplier_ids = object_ids(rng, sizes['suppliers'], datetime(2019, 1, 1), now)
+    countries = rng.choice(COUNTRIES, sizes['suppliers'], p=COUNTRY_WEIGHTS)
+    suppliers = [
+        {'name': name, 'country': str(country), '_id': supplier_id}
+        for supplier_id, name, country in zip(supplier_ids, random_names(rng, sizes['suppliers'], 12), countries)
+    ]
+
+    # Each run scrapes between 3 and 500 suppliers on the first of a month
+    run_ids = object_ids(rng, sizes['sonar_runs'], FIRST_RUN_DATE, now)
+    run_months = rng.integers(0, 56, sizes['sonar_runs'])
+    run_supplier_counts = rng.integers(3, min(500, sizes['suppliers']) + 1, sizes['sonar_runs'])
+    run_supplier_offsets = np.concatenate([[0], np.cumsum(run_supplier_counts)[:-1]])
+    run_suppliers = np.concatenate([
+        rng.choice(sizes['suppliers'], count, replace=False) for count in run_supplier_counts
+    ])
+    statuses = rng.choice(RUN_STATUSES, sizes['sonar_runs'], p=RUN_STATUS_WEIGHTS)
+    run_clients = rng.integers(0, sizes['clients'], sizes['sonar_runs'])
+    sonar_runs = [
+        {'_id': run_ids[run],
+         'date': datetime(2020 + int(run_months[run]) // 12, 1 + int(run_months[run]) % 12, 1),
+         'status': str(statuses[run]),
+         'client_id': client_ids[run_clients[run]],
+         'supplier_ids': [supplier_ids[supplier] for supplier in
+                          run_suppliers[run_supplier_offsets[run]:run_supplier_offsets[run] + run_supplier_counts[run]]]}
+        for run in range(sizes['sonar_runs'])
+    ]
+
+    part_ids = object_ids(rng, sizes['parts'], FIRST_RUN_DATE, now)
+
+    def sonar_results():
+        for start in range(0, results, batch_size):
+            count = min(batch_size, results - start)
+            runs = rng.integers(0, sizes['sonar_runs'], count)
+            # A supplier of the result's own run
+            picks = (rng.random(count) * run_supplier_counts[runs]).astype(np.int64)
+            suppliers_of_results = run_suppliers[run_supplier_offsets[runs] + picks]
+            parts = rng.integers(0, sizes['parts'], count)
+            prices = np.round(rng.lognormal(5, 2, count), 2)
+            unknown = rng.random(count) < UNKNOWN_REFERENCE_RATE
+            result_ids = object_ids(rng, count, FIRST_RUN_DATE, now)
+
+            batch = []
+            for position in range(count):
+                document = {
+                    '_id': result_ids[position],
+                    'price_norm': float(prices[position]),
+                    'part_id': part_ids[parts[position]],
+                    'supplier_id': supplier_ids[suppliers_of_results[position]],
+                    'sonar_run_id': run_ids[runs[position]],
+                }
+                if unknown[position]:
+                    # ids from a time range no generated entity uses
+                    document['sonar_run_id' if position % 2 else 'supplier_id'] = ObjectId(f"{0:08x}{start + position:016x}")
+                batch.append(document)
+            yield batch
+
+    return {
+        'clients': iter([clients]),
+        'suppliers': iter([suppliers]),
+        'sonar_runs': iter([sonar_runs]),
+        'sonar_results': sonar_results(),
+    }
+
+
+# Native document -> Extended JSON ({"$oid": ...}, {"$date": ...}), the form
+# of the dumps in collections.zip
+def to_extended(value):
+    if isinstance(value, ObjectId):
+        return {'$oid': str(value)}
+    if isinstance(value, datetime):
+        return {'$date': value.replace(tzinfo=timezone.utc).isoformat().replace('+00:00', 'Z')}
+    if isinstance(value, dict):
+        return {key: to_extended(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [to_extended(item) for item in value]
+    return value
+
+
+# Write one collection as a top-level JSON array, batch by batch. The native
+# form is serialised with json.dump(default=str), as the native-json source
+# of etl_engine expects.
+def write_collection(file_path, batches, form='extended'):
+    documents = 0
+    with open(file_path, 'w') as f:
+        f.write('[')
+        for batch in batches:
+            for document in batch:
+                if documents:
+                    f.write(', ')
+                if form == 'extended':
+                    f.write(json.dumps(to_extended(document)))
+                else:
+                    f.write(json.dumps(document, default=str))
+                documents += 1
+        f.write(']')
+    return documents
+
+
+def write_json_dump(output_path, results, form='extended', seed=0):
+    os.makedirs(output_path, exist_ok=True)
+    counts = {}
+    for collection_name, batches in generate_collections(results, seed).items():
+        counts[collection_name] = write_collection(os.path.join(output_path, f'{collection_name}.json'), batches, form)
+        print(f"{collection_name}: {counts[collection_name]} documents written")
+    return counts
+
+
+# Insert the native documents into a (local) MongoDB database
+def insert_into_mongodb(db, results, seed=0):
+    counts = {}
+    for collection_name, batches in generate_collections(results, seed).items():
+        db[collection_name].drop()
+        counts[collection_name] = 0
+        for batch in batches:
+            db[collection_name].insert_many(batch, ordered=False)
+            counts[collection_name] += len(batch)
+        print(f"{collection_name}: {counts[collection_name]} documents inserted")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Markt-Pilot collections")
+    parser.add_argument('results', type=float, help="number of sonar_results, e.g. 1e6")
+    parser.add_argument('--form', choices=['extended', 'native'], default='extended',
+                        help="Extended JSON ($oid/$date) or native dump (ObjectIds and dates as strings)")
+    parser.add_argument('--output', default=SYNTHETIC_PATH,
+                        help="folder the JSON files are written to (default: %(default)s; not collections/, "
+                             "which holds the sample dumps)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mongo-uri', help="insert into MongoDB instead of writing JSON files")
+    parser.add_argument('--database', default='Markt-Pilot')
+    args = parser.parse_args()
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        insert_into_mongodb(MongoClient(args.mongo_uri)[args.database], int(args.results), args.seed)
+    else:
+        write_json_dump(args.output, int(args.results), args.form, args.seed)
+
+
+if __name__ == "__main__":
+    main()
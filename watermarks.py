@@ -0,0 +1,25 @@
+import os
+import json
+
+# High-watermarks of the incremental extract, one entry per collection
+WATERMARKS_FILE = os.path.join('collections', 'watermarks.json')
+
+
+def load_watermarks(file_path=WATERMARKS_FILE):
+    if not os.path.exists(file_path):
+        return {}
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+
+# Write a JSON state file (watermarks, load checkpoints) to a temporary file
+# first, so a crash never leaves a half-written state file
+def save_json_atomic(data, file_path):
+    temp_path = f"{file_path}.tmp"
+    with open(temp_path, 'w') as f:
+        json.dump(data, f, indent=4)
+    os.replace(temp_path, file_path)
+
+
+def save_watermarks(watermarks, file_path=WATERMARKS_FILE):
+    save_json_atomic(watermarks, file_path)